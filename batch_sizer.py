@@ -0,0 +1,113 @@
+"""
+batch_sizer.py
+自适应批量大小
+"""
+import json
+import threading
+from typing import Dict, Optional
+
+from astrbot.api import logger
+
+from .utils import write_json_atomic
+
+
+class BatchSizer:
+    """
+    自动探测服务商可接受的最大批量，并根据观测到的吞吐量选择最优批量
+    批量成功达到一定次数后翻倍尝试，被拒绝后以更小的批量重试
+    拆分后的请求全部成功才记录上限，拆分后仍失败说明是个别文本的问题，恢复原批量
+    """
+    MIN_SAMPLES = 3
+
+    def __init__(self, initial: int = 16, max_size: int = 2048, alpha: float = 0.3):
+        self.current = initial
+        self.max_size = max_size
+        self.alpha = alpha
+        # 已知可接受的最大批量，None表示尚未遇到拒绝
+        self.ceiling: Optional[int] = None
+        # 批量大小 -> (每秒处理文本数的滑动平均, 样本数)
+        self._throughput: Dict[int, tuple] = {}
+
+    def on_success(self, size: int, elapsed: float):
+        if size != self.current:
+            # 只有满批次的耗时能反映该批量的吞吐量
+            return
+        rate = size / elapsed if elapsed > 0 else float(size)
+        avg, samples = self._throughput.get(size, (rate, 0))
+        avg = avg if samples == 0 else (1 - self.alpha) * avg + self.alpha * rate
+        self._throughput[size] = (avg, samples + 1)
+        self._adjust()
+
+    def on_rejected(self, size: int):
+        """批量被服务端拒绝，之后暂时使用一半的批量，单条文本被拒绝不影响批量"""
+        if size <= 1:
+            return
+        self.current = max(1, min(self.current, size // 2))
+
+    def on_split_succeeded(self, size: int):
+        """被拒绝的批量拆分后全部成功，说明确实是批量过大，记录上限"""
+        if size <= 1:
+            return
+        ceiling = min(self.ceiling or size, size - 1)
+        if ceiling != self.ceiling:
+            self.ceiling = ceiling
+            logger.info(f"批量上限探测为{self.ceiling}")
+        # 拆分期间可能已按吞吐量调大了批量
+        self.current = min(self.current, self.ceiling)
+
+    def on_split_failed(self, size: int):
+        """被拒绝的批量拆分后仍然失败，是个别文本的问题，恢复拒绝前的批量"""
+        limit = min(self.max_size, self.ceiling or self.max_size)
+        self.current = max(self.current, min(size, limit))
+
+    def _adjust(self):
+        _, samples = self._throughput[self.current]
+        if samples < self.MIN_SAMPLES:
+            return
+        bigger = self.current * 2
+        limit = min(self.max_size, self.ceiling or self.max_size)
+        if bigger <= limit and bigger not in self._throughput:
+            self.current = bigger
+            return
+        sampled = {s: v[0] for s, v in self._throughput.items() if v[1] >= self.MIN_SAMPLES and s <= limit}
+        if sampled:
+            self.current = max(sampled, key=sampled.get)
+
+    def state(self) -> dict:
+        return {
+            "current": self.current,
+            "ceiling": self.ceiling,
+            "throughput": {str(s): v[0] for s, v in self._throughput.items() if v[1] >= self.MIN_SAMPLES},
+        }
+
+    def load(self, state: Optional[dict]):
+        """恢复之前学习到的批量参数"""
+        if not state:
+            return
+        self.ceiling = state.get("ceiling")
+        self.current = max(1, int(state.get("current", self.current)))
+        for size, rate in state.get("throughput", {}).items():
+            self._throughput[int(size)] = (rate, self.MIN_SAMPLES)
+
+
+class BatchSizeStore:
+    """将各服务商学习到的批量参数保存在json文件中，重启后复用"""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, dict] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取批量参数失败: {str(e)}")
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._data.get(key)
+
+    def save(self, states: Dict[str, dict]):
+        with self._lock:
+            self._data.update(states)
+            write_json_atomic(self.path, self._data)
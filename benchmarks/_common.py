@@ -0,0 +1,44 @@
+"""
+benchmarks/_common.py
+基准测试公共工具，在AstrBot根目录下运行，以便导入astrbot与插件模块
+"""
+import importlib
+import os
+import sys
+import time
+from typing import Optional
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_PACKAGE = os.path.basename(PLUGIN_DIR)
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+
+
+def load(module: str):
+    """按插件包名导入插件内的模块，如 load("embedding_cache")"""
+    return importlib.import_module(f"{PLUGIN_PACKAGE}.{module}")
+
+
+def timeit(func, repeat: int = 1) -> float:
+    """返回func平均每次调用耗时（秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def current_rss() -> Optional[int]:
+    """当前进程占用的物理内存（字节），无法获取时返回None"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # 非Linux系统只能取得历史峰值
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,44 @@
+"""
+benchmarks/bench_cache_lookup.py
+对比线性扫描与FuzzyIndex(MinHash/LSH)在不同缓存规模下的单次查询耗时
+用法: python data/plugins/<插件目录>/benchmarks/bench_cache_lookup.py
+"""
+import random
+
+from _common import load, timeit
+
+utils = load("utils")
+embedding_cache = load("embedding_cache")
+
+WORDS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理世车".replace("", " ").split()
+
+
+def random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(WORDS) for _ in range(rng.randint(10, 40)))
+
+
+def linear_lookup(entries, text, threshold=0.9):
+    for k in entries:
+        if utils.str_similarity(k, text) > threshold:
+            return k
+    return None
+
+
+def main():
+    rng = random.Random(0)
+    queries = [random_text(rng) for _ in range(200)]
+    print(f"{'缓存条目':>8} {'线性扫描(us)':>14} {'LSH索引(us)':>14} {'精确命中(us)':>14}")
+    for size in (100, 1000, 5000, 20000):
+        keys = [random_text(rng) for _ in range(size)]
+        cache = embedding_cache.MemoryEmbeddingCache(expire=3600, max_entries=size, max_bytes=1 << 40)
+        for k in keys:
+            cache.set(k, [0.0])
+        linear_queries = queries[:20] if size > 1000 else queries
+        linear = timeit(lambda: [linear_lookup(keys, q) for q in linear_queries]) / len(linear_queries)
+        indexed = timeit(lambda: [cache.get(q) for q in queries]) / len(queries)
+        exact = timeit(lambda: [cache.get(k) for k in keys[:200]]) / 200
+        print(f"{size:>8} {linear * 1e6:>14.1f} {indexed * 1e6:>14.1f} {exact * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+benchmarks/bench_similarity.py
+对比逐条计算的纯Python余弦相似度与similarity模块的批量计算、top-k检索耗时
+用法: python data/plugins/<插件目录>/benchmarks/bench_similarity.py
+"""
+import numpy as np
+
+from _common import load, timeit
+
+similarity = load("similarity")
+
+DIM = 768
+K = 10
+
+
+def python_cosine(a, b):
+    """原utils.vec_similarity的纯Python实现"""
+    dot_product = sum(x * y for x, y in zip(a, b))
+    norm_a = sum(x ** 2 for x in a) ** 0.5
+    norm_b = sum(y ** 2 for y in b) ** 0.5
+    return dot_product / (norm_a * norm_b) if norm_a and norm_b else 0.0
+
+
+def python_top_k(query, vectors, k):
+    scores = [python_cosine(query, v) for v in vectors]
+    return sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:k]
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'向量数':>8} {'纯Python(ms)':>14} {'批量余弦(ms)':>14} {'top-k(ms)':>12} {'预归一化top-k(ms)':>18}")
+    for size in (100, 1000, 10000, 100000):
+        matrix = rng.standard_normal((size, DIM), dtype=np.float32)
+        query = rng.standard_normal(DIM, dtype=np.float32)
+        normalized = similarity.normalize(matrix)
+        if size <= 10000:
+            vectors, q = matrix.tolist(), query.tolist()
+            python = timeit(lambda: python_top_k(q, vectors, K)) * 1e3
+            expected = python_top_k(q, vectors, K)
+            assert list(similarity.top_k(query, matrix, K)[0]) == expected
+            python = f"{python:.2f}"
+        else:
+            python = "-"
+        repeat = max(1, 100000 // size)
+        batch = timeit(lambda: similarity.cosine_similarity(query, matrix), repeat) * 1e3
+        top = timeit(lambda: similarity.top_k(query, matrix, K), repeat) * 1e3
+        pre = timeit(lambda: similarity.top_k(query, normalized, K, normalized=True), repeat) * 1e3
+        print(f"{size:>8} {python:>14} {batch:>14.3f} {top:>12.3f} {pre:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
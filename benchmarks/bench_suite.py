@@ -0,0 +1,322 @@
+"""
+benchmarks/bench_suite.py
+启动本地模拟服务，通过EmbeddingAdapter运行典型负载，统计吞吐量、p50/p99延迟与内存峰值，
+结果保存为JSON基线，之后的运行与基线对比，超出容差时以非零状态码退出
+用法: python data/plugins/<插件目录>/benchmarks/bench_suite.py [--scenario 名称 ...] [--quick] [--save]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+
+from typing import Optional
+
+import numpy as np
+
+from _common import current_rss, load
+from mock_servers import MockServerProcess
+
+main_module = load("main")
+
+MODEL = "mock-embed"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# 对比基线时的指标: (方向, 可忽略的绝对变化)，方向1表示越大越好，-1表示越小越好
+COMPARED = {"throughput": (1, 0), "p50_ms": (-1, 5), "p99_ms": (-1, 5), "peak_mb": (-1, 5)}
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    """随机汉字组成的文本，字符集合各不相同，不会因近似匹配互相命中缓存"""
+    return "".join(chr(0x4e00 + rng.randrange(20000)) for _ in range(length))
+
+
+class MemorySampler:
+    """
+    在后台线程中定期采样进程内存，记录相对开始时的最大增量
+    tracemalloc会使被测代码变慢数倍，因此不使用
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_rss = current_rss()
+        self.peak_rss = self.start_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def __enter__(self):
+        if self.start_rss is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        if self.start_rss is None:
+            return None
+        return round((self.peak_rss - self.start_rss) / 1024 / 1024, 2)
+
+
+def build_config(servers: MockServerProcess, scenario: dict) -> dict:
+    """按模拟服务生成插件配置，同类服务只有openai支持配置多个"""
+    config = {
+        "whichgroup": MODEL,
+        "probe": {"cache": False, "startup_timeout": 10},
+        "health": {"interval": 3600},
+    }
+    openai_urls = []
+    for spec, url in zip(servers.specs, servers.urls):
+        provider = {"embed_model": MODEL, "batch_size": str(spec.get("batch_size", 64)),
+                    "max_concurrency": spec.get("max_concurrency", 4)}
+        if spec["kind"] == "openai":
+            openai_urls.append((url, provider))
+        elif spec["kind"] == "ollama":
+            config["ollama"] = dict(provider, api_url=url)
+        else:
+            config["gemini"] = dict(provider, api_url=url, api_key="mock")
+    if openai_urls:
+        config["openai"] = dict(
+            openai_urls[0][1],
+            api_url=",".join(u for u, _ in openai_urls),
+            api_key=",".join("mock" for _ in openai_urls),
+            embed_model=",".join(MODEL for _ in openai_urls),
+            batch_size=",".join(p["batch_size"] for _, p in openai_urls),
+        )
+    for section, values in scenario.get("config", {}).items():
+        config.setdefault(section, {}).update(values)
+    return config
+
+
+async def timed(latencies: list, coro):
+    start = time.perf_counter()
+    result = await coro
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+async def gather_limited(coros, limit: int):
+    """最多limit个协程同时运行"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+    return await asyncio.gather(*[run(c) for c in coros])
+
+
+def flatten(batches) -> list:
+    return [v for batch in batches for v in batch]
+
+
+# ---- 负载，返回得到的全部向量，失败的文本为None ----
+
+async def single_burst(adapter, rng, scale, latencies):
+    """大量并发的单条请求，如多个会话同时检索记忆"""
+    texts = [random_text(rng, rng.randint(10, 60)) for _ in range(int(500 * scale))]
+    return await asyncio.gather(*[timed(latencies, adapter.get_embedding_async(t)) for t in texts])
+
+
+async def large_batch(adapter, rng, scale, latencies):
+    """一次提交数千条文本，如导入知识库"""
+    results = []
+    for _ in range(3):
+        texts = [random_text(rng, 100) for _ in range(int(4000 * scale))]
+        results.extend(await timed(latencies, adapter.get_embeddings_async(texts)))
+    return results
+
+
+async def mixed_lengths(adapter, rng, scale, latencies):
+    """长短差异很大的文本混合提交"""
+    calls = []
+    for _ in range(int(40 * scale)):
+        texts = [random_text(rng, min(6000, int(rng.lognormvariate(4, 1.2)) + 1)) for _ in range(50)]
+        calls.append(timed(latencies, adapter.get_embeddings_async(texts)))
+    return flatten(await gather_limited(calls, 8))
+
+
+async def flaky_providers(adapter, rng, scale, latencies):
+    """部分服务商频繁出错，依赖重试与熔断转移到其他服务商"""
+    calls = [timed(latencies, adapter.get_embeddings_async([random_text(rng, 50) for _ in range(100)]))
+             for _ in range(int(30 * scale))]
+    return flatten(await gather_limited(calls, 4))
+
+
+async def cache_heavy(adapter, rng, scale, latencies):
+    """少量热点文本被反复查询"""
+    pool = [random_text(rng, 30) for _ in range(200)]
+    weights = [1 / (i + 1) for i in range(len(pool))]
+    calls = [timed(latencies, adapter.get_embedding_async(rng.choices(pool, weights)[0]))
+             for _ in range(int(3000 * scale))]
+    return await gather_limited(calls, 20)
+
+
+async def interactive(adapter, rng, scale, latencies):
+    """逐条串行的单条请求，如对话中检索记忆，用户直接感受到每次请求的延迟"""
+    results = []
+    for _ in range(int(300 * scale)):
+        results.append(await timed(latencies, adapter.get_embedding_async(random_text(rng, 30))))
+    return results
+
+
+async def heterogeneous(adapter, rng, scale, latencies):
+    """OpenAI、Ollama、Gemini三类服务商组成同一模型组"""
+    calls = [timed(latencies, adapter.get_embeddings_async([random_text(rng, 60) for _ in range(200)]))
+             for _ in range(int(20 * scale))]
+    return flatten(await gather_limited(calls, 6))
+
+
+SCENARIOS = {
+    "single_burst": {
+        "workload": single_burst,
+        "servers": [{"kind": "openai"}, {"kind": "openai"}],
+    },
+    "single_burst_micro_batch": {
+        "workload": single_burst,
+        "servers": [{"kind": "openai"}, {"kind": "openai"}],
+        "config": {"scheduler": {"micro_batch": True}},
+    },
+    "large_batch": {
+        "workload": large_batch,
+        "servers": [{"kind": "openai", "batch_size": 256, "max_batch": 256},
+                    {"kind": "openai", "batch_size": 256, "max_batch": 256}],
+    },
+    "mixed_lengths": {
+        "workload": mixed_lengths,
+        "servers": [{"kind": "openai", "per_text": 0.001}, {"kind": "ollama", "per_text": 0.001}],
+        "config": {"openai": {"max_batch_tokens": 8000}, "ollama": {"max_batch_tokens": 8000}},
+    },
+    "flaky_providers": {
+        "workload": flaky_providers,
+        "servers": [{"kind": "openai", "failure_rate": 0.3}, {"kind": "openai", "failure_rate": 0.05},
+                    {"kind": "openai", "latency": 0.1}],
+        "config": {"scheduler": {"retry_backoff": 0.05}},
+    },
+    "cache_heavy": {
+        "workload": cache_heavy,
+        "servers": [{"kind": "openai"}],
+        "config": {"cache": {"memory_expire": 600}},
+    },
+    "interactive_tail": {
+        "workload": interactive,
+        "servers": [{"kind": "openai", "latency": 0.02, "slow_rate": 0.03} for _ in range(3)],
+    },
+    "interactive_tail_hedged": {
+        "workload": interactive,
+        "servers": [{"kind": "openai", "latency": 0.02, "slow_rate": 0.03} for _ in range(3)],
+        "config": {"scheduler": {"hedge": True}},
+    },
+    "heterogeneous": {
+        "workload": heterogeneous,
+        "servers": [{"kind": "openai"}, {"kind": "ollama"}, {"kind": "gemini", "batch_size": 100}],
+    },
+}
+
+
+async def run_scenario(name: str, scenario: dict, scale: float, seed: int) -> dict:
+    with MockServerProcess([dict(spec, seed=seed + i) for i, spec in enumerate(scenario["servers"])]) as servers:
+        adapter = main_module.EmbeddingAdapter(None, build_config(servers, scenario))
+        try:
+            if adapter.current_provider_group is None:
+                raise RuntimeError(f"场景{name}没有可用的模型组")
+            providers = len(adapter.current_provider_group.providers)
+            latencies = []
+            with MemorySampler() as memory:
+                start = time.perf_counter()
+                vectors = await scenario["workload"](adapter, random.Random(seed), scale, latencies)
+                elapsed = time.perf_counter() - start
+        finally:
+            await adapter.terminate()
+        server_stats = servers.stats()
+    texts, failed = len(vectors), sum(1 for v in vectors if v is None)
+    return {
+        "providers": providers,
+        "calls": len(latencies),
+        "texts": texts,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "throughput": round(texts / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+        "peak_mb": memory.peak_mb,
+        "server_requests": sum(s["requests"] for s in server_stats),
+        "server_errors": sum(s["failures"] + s["rejected"] for s in server_stats),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """返回超出容差的(场景, 指标, 基线值, 当前值)"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        for metric, (direction, slack) in COMPARED.items():
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None or abs(new - old) <= slack:
+                continue
+            if (new - old) / old * direction < -tolerance:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embedding插件基准测试")
+    parser.add_argument("--scenario", nargs="*", choices=list(SCENARIOS), help="只运行指定场景")
+    parser.add_argument("--quick", action="store_true", help="负载缩小为1/5，用于快速检查")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--save", action="store_true", help="将本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的相对退化比例")
+    args = parser.parse_args()
+
+    scale = 0.2 if args.quick else 1.0
+    names = args.scenario or list(SCENARIOS)
+    results = {}
+    print(f"{'场景':<26} {'文本数':>7} {'失败':>5} {'吞吐(条/秒)':>12} {'p50(ms)':>9} {'p99(ms)':>9} "
+          f"{'内存增量(MB)':>13} {'服务端请求':>10}")
+    for name in names:
+        r = results[name] = asyncio.run(run_scenario(name, SCENARIOS[name], scale, args.seed))
+        print(f"{name:<26} {r['texts']:>7} {r['failed']:>5} {r['throughput']:>12.1f} {r['p50_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {r['peak_mb'] if r['peak_mb'] is not None else '-':>13} {r['server_requests']:>10}")
+
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "seed": args.seed,
+        "scenarios": results,
+    }
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"已保存基线: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("没有基线文件，使用--save保存本次结果作为基线")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("scale") != scale:
+        print(f"基线的负载规模为{baseline.get('scale')}，与本次{scale}不同，跳过对比")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, old, new in regressions:
+        print(f"退化: {name} {metric} {old} -> {new}")
+    if regressions:
+        sys.exit(1)
+    print(f"与基线({baseline.get('created')})相比无超过{args.tolerance:.0%}的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+benchmarks/mock_servers.py
+本地模拟的OpenAI、Ollama、Gemini embedding服务，可配置延迟、抖动、长尾、失败率与批量上限
+相同文本在所有服务上返回相同的向量，因此同一model的模拟服务会被插件归入同一模型组
+单独运行: python mock_servers.py openai --port 8001 --latency 0.05 --failure-rate 0.1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+KINDS = ("openai", "ollama", "gemini")
+
+DEFAULT_SPEC = {
+    "kind": "openai",
+    "port": 0,
+    "dim": 256,
+    "latency": 0.05,     # 每个请求的基础延迟（秒）
+    "per_text": 0.0005,  # 每条文本增加的延迟（秒）
+    "jitter": 0.02,      # 额外的随机延迟上限（秒）
+    "slow_rate": 0.0,    # 请求变慢的概率，模拟长尾延迟
+    "slow_latency": 1.0, # 变慢时额外增加的延迟（秒）
+    "failure_rate": 0.0,
+    "failure_status": 500,
+    "max_batch": 0,      # 单个请求的最大文本数，超过时返回400 too many inputs，0为不限
+    "seed": 0,
+}
+
+
+def mock_vector(text: str, dim: int) -> np.ndarray:
+    """由文本确定的单位向量"""
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+class MockEmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, spec: dict):
+        self.spec = dict(DEFAULT_SPEC, **spec)
+        if self.spec["kind"] not in KINDS:
+            raise ValueError(f"不支持的模拟服务类型: {self.spec['kind']}")
+        self.rng = random.Random(self.spec["seed"])
+        self.lock = threading.Lock()
+        # inflight为正在处理的请求数，max_inflight为同时处理的请求数峰值
+        self.stats = {"requests": 0, "texts": 0, "failures": 0, "rejected": 0, "inflight": 0, "max_inflight": 0}
+        super().__init__(("127.0.0.1", self.spec["port"]), _Handler)
+
+    @property
+    def url(self) -> str:
+        base = f"http://127.0.0.1:{self.server_port}"
+        return base + "/v1" if self.spec["kind"] == "openai" else base
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def plan(self, count: int) -> tuple:
+        """决定本次请求的(延迟, 状态码, 错误信息)，状态码为None表示正常返回"""
+        spec = self.spec
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += count
+            self.stats["inflight"] += 1
+            self.stats["max_inflight"] = max(self.stats["max_inflight"], self.stats["inflight"])
+            delay = spec["latency"] + spec["per_text"] * count + self.rng.uniform(0, spec["jitter"])
+            if self.rng.random() < spec["slow_rate"]:
+                delay += spec["slow_latency"]
+            if spec["max_batch"] and count > spec["max_batch"]:
+                self.stats["rejected"] += 1
+                return delay, 400, f"Too many inputs: at most {spec['max_batch']} inputs per request"
+            if self.rng.random() < spec["failure_rate"]:
+                self.stats["failures"] += 1
+                return delay, spec["failure_status"], "mock error"
+        return delay, None, None
+
+    def finish(self):
+        """请求处理完毕"""
+        with self.lock:
+            self.stats["inflight"] -= 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockEmbeddingServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, obj, status: int = 200, headers: Optional[dict] = None):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已取消请求（如对冲请求中较慢的一方）
+            self.close_connection = True
+
+    def _send_error(self, status: int, message: str):
+        headers = {"Retry-After": "1"} if status == 429 else None
+        if self.server.spec["kind"] == "gemini":
+            body = {"error": {"code": status, "message": message, "status": "UNAVAILABLE"}}
+        elif self.server.spec["kind"] == "ollama":
+            body = {"error": message}
+        else:
+            body = {"error": {"message": message, "type": "server_error", "code": status}}
+        self._send(body, status, headers)
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            with self.server.lock:
+                return self._send(dict(self.server.stats))
+        # Ollama的/api/tags
+        self._send({"models": []})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        kind = self.server.spec["kind"]
+        if kind == "openai":
+            texts = body.get("input", [])
+        elif kind == "ollama":
+            texts = [body.get("prompt", "")] if self.path.endswith("/api/embeddings") else body.get("input", [])
+        else:
+            if self.path.endswith(":embedContent"):
+                texts = ["".join(p.get("text", "") for p in body["content"]["parts"])]
+            else:
+                texts = ["".join(p.get("text", "") for p in r["content"]["parts"]) for r in body.get("requests", [])]
+        if isinstance(texts, str):
+            texts = [texts]
+        delay, status, message = self.server.plan(len(texts))
+        try:
+            self._respond(kind, body, texts, delay, status, message)
+        finally:
+            self.server.finish()
+
+    def _respond(self, kind: str, body: dict, texts: List[str], delay: float, status: Optional[int],
+                 message: Optional[str]):
+        time.sleep(delay)
+        if status is not None:
+            return self._send_error(status, message)
+        dim = self.server.spec["dim"]
+        vectors = [mock_vector(t, dim) for t in texts]
+        if kind == "openai":
+            as_base64 = body.get("encoding_format") == "base64"
+            data = [{
+                "object": "embedding",
+                "index": i,
+                "embedding": base64.b64encode(v.tobytes()).decode() if as_base64 else v.tolist(),
+            } for i, v in enumerate(vectors)]
+            tokens = sum(len(t) for t in texts)
+            self._send({"object": "list", "model": body.get("model", ""), "data": data,
+                        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+        elif kind == "ollama":
+            if self.path.endswith("/api/embeddings"):
+                self._send({"embedding": vectors[0].tolist()})
+            else:
+                self._send({"model": body.get("model", ""), "embeddings": [v.tolist() for v in vectors]})
+        elif self.path.endswith(":embedContent"):
+            self._send({"embedding": {"values": vectors[0].tolist()}})
+        else:
+            self._send({"embeddings": [{"values": v.tolist()} for v in vectors]})
+
+
+class MockServerProcess:
+    """
+    在子进程中启动一组模拟服务，避免服务端的序列化开销与被测插件争用GIL
+    """
+    def __init__(self, specs: List[dict]):
+        self.specs = specs
+        self.process = subprocess.Popen(
+            [sys.executable, __file__, "--serve", json.dumps(specs)],
+            stdout=subprocess.PIPE, text=True,
+        )
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError("模拟服务启动失败")
+        self.urls: List[str] = json.loads(line)
+
+    def stats(self) -> List[dict]:
+        """各模拟服务收到的请求统计"""
+        import urllib.request
+        result = []
+        for url in self.urls:
+            root = url[:-3] if url.endswith("/v1") else url
+            with urllib.request.urlopen(root + "/_stats", timeout=5) as resp:
+                result.append(json.loads(resp.read()))
+        return result
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟embedding服务")
+    parser.add_argument("kind", nargs="?", choices=KINDS, default="openai")
+    parser.add_argument("--serve", help="JSON格式的服务列表，供MockServerProcess使用")
+    parser.add_argument("--port", type=int, default=DEFAULT_SPEC["port"])
+    parser.add_argument("--dim", type=int, default=DEFAULT_SPEC["dim"])
+    parser.add_argument("--latency", type=float, default=DEFAULT_SPEC["latency"])
+    parser.add_argument("--per-text", type=float, default=DEFAULT_SPEC["per_text"])
+    parser.add_argument("--jitter", type=float, default=DEFAULT_SPEC["jitter"])
+    parser.add_argument("--slow-rate", type=float, default=DEFAULT_SPEC["slow_rate"])
+    parser.add_argument("--slow-latency", type=float, default=DEFAULT_SPEC["slow_latency"])
+    parser.add_argument("--failure-rate", type=float, default=DEFAULT_SPEC["failure_rate"])
+    parser.add_argument("--failure-status", type=int, default=DEFAULT_SPEC["failure_status"])
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_SPEC["max_batch"])
+    args = parser.parse_args()
+
+    if args.serve:
+        specs = json.loads(args.serve)
+    else:
+        specs = [{
+            "kind": args.kind, "port": args.port, "dim": args.dim, "latency": args.latency,
+            "per_text": args.per_text, "jitter": args.jitter, "slow_rate": args.slow_rate,
+            "slow_latency": args.slow_latency, "failure_rate": args.failure_rate,
+            "failure_status": args.failure_status, "max_batch": args.max_batch,
+        }]
+    servers = [MockEmbeddingServer(spec).start() for spec in specs]
+    if args.serve:
+        print(json.dumps([s.url for s in servers]), flush=True)
+    else:
+        print(f"{specs[0]['kind']}模拟服务已启动: {servers[0].url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
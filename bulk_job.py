@@ -0,0 +1,254 @@
+"""
+bulk_job.py
+可断点续传的批量向量化任务
+"""
+import json
+import os
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import numpy as np
+
+from astrbot.api import logger
+
+from .embedding_cache import DEFAULT_CACHE_DIR
+from .utils import write_json_atomic
+
+DEFAULT_JOB_DIR = os.path.join(DEFAULT_CACHE_DIR, "jobs")
+
+
+class EmbeddingJob:
+    """
+    流式读取文本或JSONL语料，向量化后按行顺序追加写入<output>.f32（float32，每行dim个数），
+    JSONL中带id字段时id逐行写入<output>.ids，进度定期保存在<output>.json中，中断后再次运行从上次保存的位置继续
+    获取失败的文本先写入全零向量，并在进度文件中记录其行号与在语料中的偏移量，
+    存在失败的行时任务不会标记为完成，再次运行时重新向量化这些行
+    """
+    CHECKPOINT_INTERVAL = 5.0  # 秒
+
+    def __init__(self, group, input_path: str, output_path: str = "", text_field: str = "text",
+                 id_field: str = "id", chunk_size: int = 256, max_pending: int = 4):
+        if not os.path.isfile(input_path):
+            raise ValueError(f"语料文件不存在: {input_path}")
+        self.group = group
+        self.input_path = os.path.abspath(input_path)
+        if not output_path:
+            output_path = os.path.join(DEFAULT_JOB_DIR, os.path.splitext(os.path.basename(input_path))[0])
+        self.output_path = output_path
+        self.text_field = text_field
+        self.id_field = id_field
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.jsonl = input_path.lower().endswith((".jsonl", ".ndjson"))
+        self.state = self._load_state()
+
+    @property
+    def vectors_path(self) -> str:
+        return self.output_path + ".f32"
+
+    @property
+    def ids_path(self) -> str:
+        return self.output_path + ".ids"
+
+    @property
+    def state_path(self) -> str:
+        return self.output_path + ".json"
+
+    def _new_state(self) -> dict:
+        return {
+            "input": self.input_path,
+            "model": self.group.get_model_name(),
+            "fingerprint": self.group.fingerprint,
+            "dim": self.group.get_dim(),
+            "status": "running",
+            "rows": 0,
+            "input_offset": 0,
+            "ids_offset": 0,
+            # [行号, 该行在语料中的起始偏移量]
+            "failed": [],
+        }
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return self._new_state()
+        if state.get("input") != self.input_path:
+            raise ValueError(f"输出{self.output_path}属于其他语料: {state.get('input')}")
+        if state.get("fingerprint") != self.group.fingerprint:
+            raise ValueError(f"输出{self.output_path}由模型{state.get('model')}生成，请切换模型组或更换输出路径")
+        return state
+
+    def _save_state(self, vectors_file, ids_file):
+        vectors_file.flush()
+        os.fsync(vectors_file.fileno())
+        if ids_file is not None:
+            ids_file.flush()
+            os.fsync(ids_file.fileno())
+        write_json_atomic(self.state_path, self.state)
+
+    def _parse_line(self, line: bytes, line_no: int):
+        """解析一行语料，返回(文本, id)，没有文本时返回None"""
+        text = line.decode("utf-8", errors="replace").strip()
+        if not text:
+            return None
+        if not self.jsonl:
+            return text, None
+        try:
+            record = json.loads(text)
+        except ValueError:
+            logger.warning(f"语料第{line_no}行(自断点起)不是合法的JSON，已跳过")
+            return None
+        text = str(record.get(self.text_field, "")) if isinstance(record, dict) else ""
+        if not text:
+            return None
+        return text, record.get(self.id_field)
+
+    def _read_records(self, pending: deque):
+        """从上次的位置逐行读取语料，每产出一条文本就把(该行起始偏移量, 读取后的偏移量, id)放入pending"""
+        with open(self.input_path, "rb") as f:
+            f.seek(self.state["input_offset"])
+            line_no = 0
+            start = f.tell()
+            for line in iter(f.readline, b""):
+                line_no += 1
+                offset = f.tell()
+                parsed = self._parse_line(line, line_no)
+                if parsed is not None:
+                    pending.append((start, offset, parsed[1]))
+                    yield parsed[0]
+                start = offset
+
+    def _read_failed(self, failed: list):
+        """按记录的偏移量重新读取失败行的文本"""
+        with open(self.input_path, "rb") as f:
+            for _, start in failed:
+                f.seek(start)
+                parsed = self._parse_line(f.readline(), 0)
+                yield parsed[0] if parsed is not None else ""
+
+    async def _retry_failed(self):
+        """重新向量化之前失败的行，写回原位置，仍然失败的行保留在failed中"""
+        state = self.state
+        failed, still_failed = state["failed"], []
+        logger.info(f"重新向量化之前失败的{len(failed)}条文本")
+        row_bytes = state["dim"] * 4
+        done = 0
+        with open(self.vectors_path, "r+b") as vectors_file:
+            try:
+                stream = self.group.aembed_stream(self._read_failed(failed), chunk_size=self.chunk_size,
+                                                  max_pending=self.max_pending, ordered=True)
+                async for i, vector in stream:
+                    if vector is None:
+                        still_failed.append(failed[i])
+                    else:
+                        vectors_file.seek(failed[i][0] * row_bytes)
+                        vectors_file.write(np.asarray(vector, dtype=np.float32).tobytes())
+                    done = i + 1
+            finally:
+                # 中断时未处理的行仍然记为失败
+                state["failed"] = still_failed + failed[done:]
+                self._save_state(vectors_file, None)
+
+    def progress(self, start_time: float, start_rows: int, start_offset: int) -> dict:
+        elapsed = max(time.time() - start_time, 1e-6)
+        total = os.path.getsize(self.input_path)
+        offset = self.state["input_offset"]
+        rate = (self.state["rows"] - start_rows) / elapsed
+        byte_rate = (offset - start_offset) / elapsed
+        return {
+            "rows": self.state["rows"],
+            "failed": len(self.state["failed"]),
+            "done": self.state["status"] == "done",
+            "percent": offset / total * 100 if total else 100.0,
+            "rate": rate,
+            "eta": (total - offset) / byte_rate if byte_rate > 0 else None,
+            "elapsed": elapsed,
+        }
+
+    async def run(self, on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        执行或继续任务
+        :param on_progress: 每次保存进度后调用，参数为progress()的返回值
+        :return: 最终进度
+        """
+        state = self.state
+        dim = state["dim"]
+        if state["status"] == "done":
+            return self.progress(time.time(), state["rows"], state["input_offset"])
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        # 丢弃上次保存进度之后写入的不完整数据
+        row_bytes = dim * 4
+        for path, size in ((self.vectors_path, state["rows"] * row_bytes), (self.ids_path, state["ids_offset"])):
+            if os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        if state["failed"]:
+            await self._retry_failed()
+        if state["rows"]:
+            logger.info(f"从第{state['rows']}条继续向量化{self.input_path}")
+
+        start_time, start_rows, start_offset = time.time(), state["rows"], state["input_offset"]
+        last_save = start_time
+        pending = deque()
+        zero = np.zeros(dim, dtype=np.float32).tobytes()
+        ids_file = None
+        with open(self.vectors_path, "ab") as vectors_file:
+            try:
+                stream = self.group.aembed_stream(self._read_records(pending), chunk_size=self.chunk_size,
+                                                  max_pending=self.max_pending, ordered=True)
+                async for _, vector in stream:
+                    start, offset, record_id = pending.popleft()
+                    if vector is None:
+                        state["failed"].append([state["rows"], start])
+                        vectors_file.write(zero)
+                    else:
+                        vectors_file.write(np.asarray(vector, dtype=np.float32).tobytes())
+                    if record_id is not None or ids_file is not None:
+                        if ids_file is None:
+                            ids_file = open(self.ids_path, "ab")
+                            # 之前的行没有id，补写空行保持行号一致
+                            ids_file.write(b"\n" * (state["rows"] - self._count_ids()))
+                        ids_file.write(("" if record_id is None else str(record_id)).replace("\n", " ").encode("utf-8") + b"\n")
+                        state["ids_offset"] = ids_file.tell()
+                    state["rows"] += 1
+                    state["input_offset"] = offset
+                    if time.time() - last_save >= self.CHECKPOINT_INTERVAL:
+                        self._save_state(vectors_file, ids_file)
+                        last_save = time.time()
+                        if on_progress is not None:
+                            on_progress(self.progress(start_time, start_rows, start_offset))
+                # 服务商故障等原因导致失败的行在下次运行时重试，全部成功才算完成
+                state["status"] = "incomplete" if state["failed"] else "done"
+                state["input_offset"] = os.path.getsize(self.input_path)
+            finally:
+                # 无论成功还是中断都保存已完成的进度
+                self._save_state(vectors_file, ids_file)
+                if ids_file is not None:
+                    ids_file.close()
+        result = self.progress(start_time, start_rows, start_offset)
+        if on_progress is not None:
+            on_progress(result)
+        return result
+
+    def _count_ids(self) -> int:
+        if not os.path.exists(self.ids_path):
+            return 0
+        with open(self.ids_path, "rb") as f:
+            return sum(1 for _ in f)
+
+    def load_vectors(self) -> np.ndarray:
+        """以内存映射方式读取已完成的向量，形状为(rows, dim)"""
+        rows, dim = self.state["rows"], self.state["dim"]
+        if rows == 0:
+            return np.empty((0, dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, dim))
+
+
+def format_progress(progress: dict) -> str:
+    eta = progress.get("eta")
+    eta_text = f"{eta:.0f}秒" if eta is not None else "未知"
+    return (f"已完成{progress['rows']}条({progress['percent']:.1f}%)，失败{progress['failed']}条，"
+            f"速度{progress['rate']:.1f}条/秒，预计剩余{eta_text}")
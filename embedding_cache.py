@@ -0,0 +1,365 @@
+"""
+embedding_cache.py
+embedding缓存实现
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Dict, Iterable
+
+import numpy as np
+from astrbot.api import logger
+
+from .utils import text_hash, char_set, set_similarity
+
+DEFAULT_CACHE_DIR = os.path.join("data", "plugin_data", "astrbot_plugin_embedding_adapter")
+
+# sqlite 单条语句允许的参数数量有限，批量查询时分片
+_SQL_CHUNK = 500
+
+
+def pack_vector(vec) -> bytes:
+    """将向量压缩为float32字节串"""
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def unpack_vector(blob: bytes) -> np.ndarray:
+    """将float32字节串还原为向量"""
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+# MinHash参数：_LSH_BANDS个分段，每段_LSH_ROWS个哈希
+# 相似度0.9的两个集合成为候选的概率约为 1-(1-0.9^3)^8 > 99.99%，相似度0.3时约为2%
+_LSH_BANDS = 8
+_LSH_ROWS = 3
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_PARAMS = [
+    ((i * 0x9E3779B97F4A7C15 + 0x632BE59BD9B4E019) % _MINHASH_PRIME | 1,
+     (i * 0xC2B2AE3D27D4EB4F + 0x165667B19E3779F9) % _MINHASH_PRIME)
+    for i in range(1, _LSH_BANDS * _LSH_ROWS + 1)
+]
+
+
+class FuzzyIndex:
+    """
+    近似重复文本的MinHash/LSH索引
+    条目插入时预先计算字符集合与分段签名，查询时只与落入相同分段桶的集合计算Jaccard相似度
+    """
+    def __init__(self, threshold: float = 0.9):
+        self.threshold = threshold
+        self._key_sets: Dict[str, frozenset] = {}
+        # 字符集合 -> 拥有该集合的文本
+        self._set_keys: Dict[frozenset, set] = {}
+        # (分段序号, 分段签名) -> 字符集合
+        self._buckets: Dict[tuple, set] = {}
+        # 字符 -> 各哈希函数下的取值，字符表有限，缓存后签名只需取最小值
+        self._char_hashes: Dict[str, tuple] = {}
+
+    def _bands(self, chars: frozenset) -> List[tuple]:
+        columns = []
+        for c in chars:
+            hashes = self._char_hashes.get(c)
+            if hashes is None:
+                x = ord(c)
+                hashes = self._char_hashes[c] = tuple((a * x + b) % _MINHASH_PRIME for a, b in _MINHASH_PARAMS)
+            columns.append(hashes)
+        signature = [min(col) for col in zip(*columns)]
+        return [
+            (band, tuple(signature[band * _LSH_ROWS:(band + 1) * _LSH_ROWS]))
+            for band in range(_LSH_BANDS)
+        ]
+
+    def add(self, key: str):
+        if key in self._key_sets:
+            return
+        chars = char_set(key)
+        self._key_sets[key] = chars
+        keys = self._set_keys.get(chars)
+        if keys is None:
+            keys = self._set_keys[chars] = set()
+            if chars:
+                for bucket in self._bands(chars):
+                    self._buckets.setdefault(bucket, set()).add(chars)
+        keys.add(key)
+
+    def remove(self, key: str):
+        chars = self._key_sets.pop(key, None)
+        if chars is None:
+            return
+        keys = self._set_keys[chars]
+        keys.discard(key)
+        if keys:
+            return
+        del self._set_keys[chars]
+        if not chars:
+            return
+        for bucket in self._bands(chars):
+            members = self._buckets.get(bucket)
+            if members is not None:
+                members.discard(chars)
+                if not members:
+                    del self._buckets[bucket]
+
+    def clear(self):
+        self._key_sets.clear()
+        self._set_keys.clear()
+        self._buckets.clear()
+
+    def search(self, text: str) -> Optional[str]:
+        """
+        查找相似度大于阈值的已索引文本
+        :return: 相似度最高的文本，没有则返回None
+        """
+        chars = char_set(text)
+        if not chars:
+            return None
+        keys = self._set_keys.get(chars)
+        if keys:
+            return next(iter(keys))
+        size = len(chars)
+        # 长度过滤：相似度大于阈值的集合大小必然在 [threshold*|S|, |S|/threshold] 内
+        min_size = self.threshold * size
+        max_size = size / self.threshold
+        best, best_score = None, self.threshold
+        seen = set()
+        for bucket in self._bands(chars):
+            for candidate in self._buckets.get(bucket, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if not min_size <= len(candidate) <= max_size:
+                    continue
+                score = set_similarity(chars, candidate)
+                if score > best_score:
+                    best, best_score = candidate, score
+        return next(iter(self._set_keys[best])) if best is not None else None
+
+
+_FLOAT_SIZE = sys.getsizeof(0.0)
+
+
+def estimate_size(text: str, value) -> int:
+    """估算一条缓存占用的字节数（文本+向量）"""
+    size = sys.getsizeof(text)
+    if hasattr(value, "nbytes"):
+        return size + value.nbytes
+    return size + sys.getsizeof(value) + len(value) * _FLOAT_SIZE
+
+
+class MemoryEmbeddingCache:
+    """
+    内存embedding缓存，先按原文精确查找，再通过FuzzyIndex查找近似文本
+    过期按写入顺序从队首弹出，容量超限时按LRU淘汰，均为均摊O(1)
+    """
+    def __init__(self, expire: float = 20, str_threshold: float = 0.9,
+                 max_entries: int = 2000, max_bytes: int = 64 * 1024 * 1024):
+        self.expire = expire
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.nbytes = 0
+        # 文本 -> (写入时间, 向量, 字节数)，按访问顺序排列，队首为最久未使用
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # 文本 -> 写入时间，按写入顺序排列，队首最先过期
+        self._expiry: "OrderedDict[str, float]" = OrderedDict()
+        self._index = FuzzyIndex(str_threshold)
+
+    def lookup(self, text: str, fuzzy: bool = True):
+        """
+        查询缓存
+        :param fuzzy: 为False时只做精确匹配，不返回近似文本的向量
+        :return: (向量, 结果)，结果为hit(精确命中)、fuzzy_hit(近似命中)或miss
+        """
+        result = "hit"
+        entry = self._entries.get(text)
+        if entry is None:
+            key = self._index.search(text) if fuzzy else None
+            if key is None:
+                return None, "miss"
+            logger.debug(f"从缓存中获取embedding: {key} -> {text}")
+            text, entry, result = key, self._entries[key], "fuzzy_hit"
+        if time.time() - entry[0] >= self.expire:
+            self._remove(text)
+            return None, "miss"
+        self._entries.move_to_end(text)
+        return entry[1], result
+
+    def get(self, text: str):
+        return self.lookup(text)[0]
+
+    def set(self, text: str, value):
+        if text in self._entries:
+            self._remove(text)
+        now = time.time()
+        size = estimate_size(text, value)
+        self._entries[text] = (now, value, size)
+        self._expiry[text] = now
+        self._index.add(text)
+        self.nbytes += size
+        while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            if oldest == text:
+                break
+            self._remove(oldest)
+
+    def _remove(self, text: str):
+        _, _, size = self._entries.pop(text)
+        self._expiry.pop(text, None)
+        self._index.remove(text)
+        self.nbytes -= size
+
+    def cleanup(self):
+        deadline = time.time() - self.expire
+        while self._expiry:
+            text, ts = next(iter(self._expiry.items()))
+            if ts > deadline:
+                break
+            self._remove(text)
+
+    def clear(self):
+        self._entries.clear()
+        self._expiry.clear()
+        self._index.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PersistentEmbeddingCache:
+    """
+    基于sqlite的持久化embedding缓存，重启后仍然有效
+    键为(模型组名, 模型指纹, 文本哈希)，超出容量时按最近访问时间淘汰
+    命中时的访问时间先记录在内存中，每flush_interval秒或积累flush_size条后，以及写入、关闭时批量写回
+    """
+    def __init__(self, path: str = "", max_entries: int = 100000, flush_interval: float = 30.0,
+                 flush_size: int = 1000):
+        if not path:
+            path = os.path.join(DEFAULT_CACHE_DIR, "embedding_cache.db")
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, int(flush_size))
+        self._lock = threading.Lock()
+        # (模型组名, 模型指纹, 文本哈希) -> 尚未写回的最近访问时间
+        self._accessed: Dict[tuple, float] = {}
+        self._last_flush = time.time()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                text_hash BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, fingerprint, text_hash)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embedding_cache_access ON embedding_cache(last_access)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        logger.info(f"持久化缓存已加载: {path}，共{self._count}条")
+
+    def get_many(self, model: str, fingerprint: str, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        批量查询缓存
+        :return: 命中的 文本->向量 映射
+        """
+        hash_map = {text_hash(t): t for t in texts}
+        if not hash_map:
+            return {}
+        hashes = list(hash_map)
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), _SQL_CHUNK):
+                chunk = hashes[i:i + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache "
+                    f"WHERE model=? AND fingerprint=? AND text_hash IN ({placeholders})",
+                    (model, fingerprint, *chunk),
+                ).fetchall()
+                for h, blob in rows:
+                    found[hash_map[h]] = unpack_vector(blob)
+                    self._accessed[(model, fingerprint, h)] = now
+            if len(self._accessed) >= self.flush_size or now - self._last_flush >= self.flush_interval:
+                self._flush_access()
+        return found
+
+    def _flush_access(self):
+        """将内存中记录的访问时间写回数据库，调用方需持有_lock"""
+        self._last_flush = time.time()
+        if not self._accessed:
+            return
+        self._conn.executemany(
+            "UPDATE embedding_cache SET last_access=? WHERE model=? AND fingerprint=? AND text_hash=?",
+            [(ts, *key) for key, ts in self._accessed.items()],
+        )
+        self._conn.commit()
+        self._accessed.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush_access()
+
+    def get(self, model: str, fingerprint: str, text: str) -> Optional[np.ndarray]:
+        return self.get_many(model, fingerprint, [text]).get(text)
+
+    def put_many(self, model: str, fingerprint: str, items: Dict[str, np.ndarray]):
+        """批量写入缓存，超出容量时淘汰最久未访问的条目"""
+        rows = [
+            (model, fingerprint, text_hash(t), pack_vector(v), time.time())
+            for t, v in items.items() if v is not None and len(v)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            # 先写回访问时间，淘汰时才能按最新的访问顺序进行，也不会覆盖本次写入的时间
+            self._flush_access()
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            # INSERT OR REPLACE 对已存在的键也记为变更，这里只做近似计数，淘汰时再校正
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                self._evict()
+
+    def put(self, model: str, fingerprint: str, text: str, vec: np.ndarray):
+        self.put_many(model, fingerprint, {text: vec})
+
+    def _evict(self):
+        """淘汰到容量的90%，避免每次写入都触发淘汰"""
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        overflow = self._count - int(self.max_entries * 0.9)
+        if overflow <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embedding_cache WHERE rowid IN "
+            "(SELECT rowid FROM embedding_cache ORDER BY last_access LIMIT ?)",
+            (overflow,),
+        )
+        self._conn.commit()
+        self._count -= overflow
+        logger.info(f"持久化缓存淘汰{overflow}条记录")
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.close()
@@ -4,44 +4,153 @@ embedding_providers.py
 """
 import httpx
 import requests
+import requests.adapters
 import json
+import time
 import asyncio
-import openai
-from google import genai
+import hashlib
+import re
+
+import numpy as np
 
 from typing import Optional, List
 from astrbot.api import logger
 
+from .rate_limiter import RateLimiter, RateLimitedError, rate_limit_info, status_code_of, is_client_error
+from .batch_sizer import BatchSizer
+from .health import ProviderHealth
+from .utils import estimate_tokens, split_by_tokens, pack_by_tokens
+from .metrics import PROVIDER_REQUESTS, PROVIDER_LATENCY, PROVIDER_BATCH_SIZE
+
 TEXT = "test"
 
+# 服务端说明单个请求文本数过多的错误信息
+_TOO_MANY_INPUTS = re.compile(
+    r"too many (inputs|texts|requests|items)|batch size|at most \d+ (inputs|texts|requests)"
+    r"|max(imum)? (number of )?(inputs|texts|requests)",
+    re.IGNORECASE,
+)
+
+
+class EmbeddingRequestError(RuntimeError):
+    """服务商返回的结果不完整"""
+
 class Provider:
     def __init__(self,name:str, config: dict) -> None:
         self.name = name
         self.config = config
         self.model = config['embed_model']
-        self.batch_size = int(config.get('batch_size', 1))
+        # batch_size填写auto时自动探测并调整批量大小
+        self.batch_sizer: Optional[BatchSizer] = None
+        batch_size = str(config.get('batch_size', 1)).strip().lower()
+        if batch_size == "auto":
+            self.batch_sizer = BatchSizer()
+            self._batch_size = self.batch_sizer.current
+        else:
+            self._batch_size = int(batch_size)
+        # 单个请求的token上限与单条文本的token上限，0表示不限制
+        self.max_batch_tokens = int(config.get('max_batch_tokens', 0) or 0)
+        self.max_input_tokens = int(config.get('max_input_tokens', 0) or 0)
+        # 超长文本的处理方式：truncate截断，split分段后按token数加权平均
+        self.overlength = str(config.get('overlength', 'truncate') or 'truncate').strip().lower()
+        if self.overlength not in ("truncate", "split"):
+            raise ValueError(f"overlength只能为truncate或split，当前为{self.overlength}")
+        # 同一服务商的所有调用方共享的并发请求上限
+        self.max_concurrency = max(1, int(config.get('max_concurrency', 4)))
+        self._request_slots = asyncio.Semaphore(self.max_concurrency)
+        # 每分钟请求数/token数限制，0表示不限制
+        self.rate_limiter = RateLimiter(
+            rpm=float(config.get('rpm', 0) or 0),
+            tpm=float(config.get('tpm', 0) or 0),
+        )
 
+        self.health = ProviderHealth()
         self.dim:Optional[int] = None
         self.test_embedding:Optional[List[int]] = None 
 
 
     def _get_embedding(self, text: str) -> Optional[list]:
         """获取embedding(同步版本)"""
-        embeddings=self._get_embeddings([text])
-        return embeddings[0] if embeddings else None
+        pieces, owners = self._prepare([text])
+        if len(pieces) == 1:
+            embeddings = self._limited_embeddings(pieces)
+            return embeddings[0] if embeddings else None
+        # 超长文本分段后的各段按批次发送
+        results: List[Optional[list]] = [None] * len(pieces)
+        for indices in self._pack(pieces):
+            batch = [pieces[i] for i in indices]
+            for i, result in zip(indices, self._align(batch, self._limited_embeddings(batch))):
+                results[i] = result
+        return self._merge(1, pieces, owners, results)[0]
 
     def _get_embeddings(self, texts: List[str]) -> Optional[List[list]]:
         """获取embedding(同步版本)"""
         return NotImplementedError()
     
     async def _get_embedding_async(self, text: str) -> Optional[list]:
-        embeddings = await self._get_embeddings_async([text])
-        return embeddings[0] if embeddings else None
+        pieces, owners = self._prepare([text])
+        if len(pieces) == 1:
+            embeddings = await self._limited_embeddings_async(pieces)
+            return embeddings[0] if embeddings else None
+        packed = self._pack(pieces)
+        batches = [[pieces[i] for i in indices] for indices in packed]
+        responses = await asyncio.gather(*[self._limited_embeddings_async(batch) for batch in batches])
+        results: List[Optional[list]] = [None] * len(pieces)
+        for indices, batch, response in zip(packed, batches, responses):
+            for i, result in zip(indices, self._align(batch, response)):
+                results[i] = result
+        return self._merge(1, pieces, owners, results)[0]
     
     async def _get_embeddings_async(self, texts: List[str]) -> Optional[List[list]]:
-        return self._get_embeddings(texts)
+        # 没有原生异步实现的服务商在线程中执行同步请求，避免阻塞事件循环
+        async with self._request_slots:
+            return await asyncio.to_thread(self._get_embeddings, texts)
     
 
+    @property
+    def batch_size(self) -> int:
+        """当前生效的批量大小"""
+        if self.batch_sizer is not None:
+            return self.batch_sizer.current
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, value: int):
+        self._batch_size = value
+
+    def config_hash(self) -> str:
+        """配置的哈希，用于缓存探测结果，配置变化后自动失效"""
+        raw = json.dumps({"type": type(self).__name__, "config": self.config}, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def set_probe_result(self, emb: list):
+        """记录探测得到的测试向量"""
+        self.dim = len(emb)
+        self.test_embedding = emb
+
+    def batch_key(self) -> str:
+        """用于保存学习到的批量参数，同一地址的同一模型共享"""
+        return f"{type(self).__name__}|{self.config.get('api_url', '')}|{self.model}"
+
+    def _is_batch_rejected(self, e: Exception, size: int) -> bool:
+        """
+        自动批量模式下，多条文本的请求返回413，或返回400/422且错误信息说明文本数过多时视为批量过大
+        其他400/422通常是个别文本无效，拆分批量无法解决
+        """
+        if self.batch_sizer is None or size <= 1:
+            return False
+        status = status_code_of(e)
+        if status == 413:
+            return True
+        if status not in (400, 422):
+            return False
+        response = getattr(e, "response", None)
+        try:
+            body = getattr(response, "text", "") or ""
+        except Exception:
+            body = ""
+        return bool(_TOO_MANY_INPUTS.search(f"{str(e)} {body}"))
+
     def get_model_name(self) -> int:
         """获取embeddingmodel"""
         return self.config['embed_model']
@@ -51,46 +160,234 @@ class Provider:
         return self.name
 
 
-    def get_embedding(self, text: str) -> Optional[list]:
-        """获取embedding(同步版本)"""
-        try:
-            response = self._get_embedding(text)
-            return response
-        except requests.exceptions.Timeout:
+    def _log_error(self, e: Exception):
+        """按异常类型记录请求失败原因"""
+        if isinstance(e, RateLimitedError):
+            # 限流已在_on_request_error中记录
+            return
+        if isinstance(e, httpx.HTTPStatusError):
+            logger.error(f"[{self.get_provider_name()}] API错误: {e.response.status_code} - {e.response.text}")
+        elif isinstance(e, httpx.RequestError):
+            logger.error(f"[{self.get_provider_name()}] 网络请求失败: {str(e)}")
+        elif isinstance(e, requests.exceptions.Timeout):
             logger.error(f"[{self.get_provider_name()}] 请求超时")
-        except requests.exceptions.ConnectionError:
-            logger.error(f"[{self.get_provider_name()}] 连接错误")
-        except requests.exceptions.SSLError:
+        elif isinstance(e, asyncio.TimeoutError):
+            logger.error(f"[{self.get_provider_name()}] 请求超时: {str(e)}")
+        elif isinstance(e, requests.exceptions.SSLError):
             logger.error(f"[{self.get_provider_name()}] SSL证书验证失败")
-        except requests.exceptions.RequestException as e:
+        elif isinstance(e, requests.exceptions.ConnectionError):
+            logger.error(f"[{self.get_provider_name()}] 连接错误")
+        elif isinstance(e, requests.exceptions.RequestException):
             logger.error(f"[{self.get_provider_name()}] 请求发生异常:{str(e)}")
-        except json.JSONDecodeError:
+        elif isinstance(e, json.JSONDecodeError):
             logger.error(f"[{self.get_provider_name()}] 响应数据解析失败")
-        except Exception as e:
+        else:
             logger.error(f"[{self.get_provider_name()}] 未知错误: {str(e)}")
 
-    def get_embeddings(self, texts: List[str]) -> Optional[List[list]]:
+    @staticmethod
+    def _align(batch: List[str], response) -> List[Optional[list]]:
+        """保证结果与输入一一对应，数量不符时整批视为失败"""
+        if response and len(response) == len(batch):
+            return list(response)
+        return [None] * len(batch)
+
+    def get_embedding(self, text: str) -> Optional[list]:
         """获取embedding(同步版本)"""
-        all_embeddings = []
         try:
-            for i in range(0, len(texts), self.batch_size):
-                batch = texts[i:i + self.batch_size]
-                response = self._get_embeddings(batch)
-                if response:
-                    all_embeddings.extend(response)
-            return all_embeddings
-        except requests.exceptions.Timeout:
-            logger.error(f"[{self.get_provider_name()}] 请求超时")
-        except requests.exceptions.ConnectionError:
-            logger.error(f"[{self.get_provider_name()}] 连接错误")
-        except requests.exceptions.SSLError:
-            logger.error(f"[{self.get_provider_name()}] SSL证书验证失败")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[{self.get_provider_name()}] 请求发生异常:{str(e)}")
-        except json.JSONDecodeError:
-            logger.error(f"[{self.get_provider_name()}] 响应数据解析失败")
+            return self._get_embedding(text)
         except Exception as e:
-            logger.error(f"[{self.get_provider_name()}] 未知错误: {str(e)}")
+            self._log_error(e)
+
+    def _check(self, results: List[Optional[list]]) -> List[Optional[list]]:
+        """raise_errors模式下，存在失败的文本时抛出异常"""
+        failed = sum(r is None for r in results)
+        if failed:
+            raise EmbeddingRequestError(f"[{self.get_provider_name()}] {failed}条文本获取embedding失败")
+        return results
+
+    def _on_request_error(self, e: Exception) -> Exception:
+        """记录请求失败，429限流时通知限速器，并转换为RateLimitedError"""
+        retry_after = rate_limit_info(e)
+        if retry_after is None:
+            return e
+        self.rate_limiter.on_rate_limited(retry_after)
+        logger.warning(f"[{self.get_provider_name()}] 触发限流，{retry_after or self.rate_limiter.default_retry_after:.1f}秒后重试")
+        if isinstance(e, RateLimitedError):
+            return e
+        error = RateLimitedError(f"[{self.get_provider_name()}] 触发限流: {str(e)}", retry_after)
+        error.__cause__ = e
+        return error
+
+    def _on_success(self, size: int, elapsed: float):
+        self.rate_limiter.on_success()
+        self.health.record_success(elapsed)
+        if self.batch_sizer is not None:
+            self.batch_sizer.on_success(size, elapsed)
+        PROVIDER_REQUESTS.inc(provider=self.name, outcome="ok")
+        PROVIDER_LATENCY.observe(elapsed, provider=self.name)
+        PROVIDER_BATCH_SIZE.observe(size, provider=self.name)
+
+    def _on_failure(self, e: Exception, size: int, elapsed: float) -> Exception:
+        """记录失败的请求，返回应抛出的异常，限流与请求内容有误的4xx不计入健康状态"""
+        error = self._on_request_error(e)
+        if isinstance(error, RateLimitedError):
+            PROVIDER_REQUESTS.inc(provider=self.name, outcome="rate_limited")
+        elif is_client_error(e):
+            # 服务商正常响应了错误的输入，不影响其可用性
+            PROVIDER_REQUESTS.inc(provider=self.name, outcome="client_error")
+        else:
+            self.health.record_failure(f"{type(e).__name__} {str(e)}")
+            PROVIDER_REQUESTS.inc(provider=self.name, outcome="error")
+            PROVIDER_LATENCY.observe(elapsed, provider=self.name)
+            PROVIDER_BATCH_SIZE.observe(size, provider=self.name)
+        return error
+
+    def _limited_embeddings(self, batch: List[str]) -> Optional[List[list]]:
+        """遵守速率限制发送一个批次(同步版本)，批量被拒绝时拆成两半重试"""
+        wait = self.rate_limiter.reserve(sum(estimate_tokens(t) for t in batch))
+        if wait > 0:
+            time.sleep(wait)
+        start = time.time()
+        try:
+            response = self._get_embeddings(batch)
+        except Exception as e:
+            if not self._is_batch_rejected(e, len(batch)):
+                raise self._on_failure(e, len(batch), time.time() - start)
+            PROVIDER_REQUESTS.inc(provider=self.name, outcome="rejected")
+            self.batch_sizer.on_rejected(len(batch))
+            half = (len(batch) + 1) // 2
+            try:
+                response = self._align(batch[:half], self._limited_embeddings(batch[:half])) + \
+                    self._align(batch[half:], self._limited_embeddings(batch[half:]))
+            except Exception:
+                # 拆分后仍然失败，说明是个别文本的问题而不是批量过大
+                self.batch_sizer.on_split_failed(len(batch))
+                raise
+            self.batch_sizer.on_split_succeeded(len(batch))
+            return response
+        self._on_success(len(batch), time.time() - start)
+        return response
+
+    async def _limited_embeddings_async(self, batch: List[str], timeout: Optional[float] = None) -> Optional[List[list]]:
+        """
+        遵守速率限制发送一个批次(异步版本)，批量被拒绝时拆成两半重试
+        :param timeout: 请求本身的超时时间（秒），不包括等待限速的时间
+        """
+        tokens = sum(estimate_tokens(t) for t in batch)
+        wait = self.rate_limiter.reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # 请求尚未发出，归还预约的令牌
+                self.rate_limiter.refund(tokens)
+                raise
+        start = time.time()
+        try:
+            response = await asyncio.wait_for(self._get_embeddings_async(batch), timeout)
+        except asyncio.TimeoutError as e:
+            # 超时计入被动健康检查；对冲落败或调用方取消时收到的是CancelledError，不计为失败
+            error = asyncio.TimeoutError(f"请求超过{timeout}秒未返回") if timeout is not None else e
+            if error is not e:
+                error.__cause__ = e
+            raise self._on_failure(error, len(batch), time.time() - start)
+        except Exception as e:
+            if not self._is_batch_rejected(e, len(batch)):
+                raise self._on_failure(e, len(batch), time.time() - start)
+            PROVIDER_REQUESTS.inc(provider=self.name, outcome="rejected")
+            self.batch_sizer.on_rejected(len(batch))
+            half = (len(batch) + 1) // 2
+            try:
+                first, second = await asyncio.gather(
+                    self._limited_embeddings_async(batch[:half], timeout),
+                    self._limited_embeddings_async(batch[half:], timeout),
+                )
+            except Exception:
+                # 拆分后仍然失败，说明是个别文本的问题而不是批量过大
+                self.batch_sizer.on_split_failed(len(batch))
+                raise
+            self.batch_sizer.on_split_succeeded(len(batch))
+            return self._align(batch[:half], first) + self._align(batch[half:], second)
+        self._on_success(len(batch), time.time() - start)
+        return response
+
+    def _prepare(self, texts: List[str]):
+        """
+        按max_input_tokens截断或切分超长文本
+        :return: (实际请求的文本, 每段对应的原文下标)
+        """
+        pieces, owners = [], []
+        overlength = 0
+        for i, text in enumerate(texts):
+            parts = [text]
+            if self.max_input_tokens > 0 and estimate_tokens(text) > self.max_input_tokens:
+                overlength += 1
+                parts = split_by_tokens(text, self.max_input_tokens)
+                if self.overlength == "truncate":
+                    parts = parts[:1]
+            pieces.extend(parts)
+            owners.extend([i] * len(parts))
+        if overlength:
+            action = "截断" if self.overlength == "truncate" else "分段"
+            logger.warning(f"[{self.get_provider_name()}] {overlength}条文本超过{self.max_input_tokens}token，已{action}处理")
+        return pieces, owners
+
+    def _pack(self, texts: List[str]) -> List[List[int]]:
+        """按数量与token数装箱，返回每个批次的下标，设置了tpm时每批不超过令牌桶容量"""
+        max_tokens = self.max_batch_tokens
+        bucket_tokens = self.rate_limiter.max_request_tokens
+        if bucket_tokens > 0:
+            max_tokens = min(max_tokens, bucket_tokens) if max_tokens > 0 else bucket_tokens
+        return pack_by_tokens([estimate_tokens(t) for t in texts], self.batch_size, max_tokens)
+
+    @staticmethod
+    def _merge(count: int, pieces: List[str], owners: List[int], results: List[Optional[list]]) -> List[Optional[list]]:
+        """将分段结果按token数加权平均并重新归一化后合并回原文，任一分段失败则该文本失败"""
+        if len(pieces) == count:
+            return results
+        merged: List[Optional[list]] = [None] * count
+        groups = {}
+        for piece, owner, result in zip(pieces, owners, results):
+            groups.setdefault(owner, []).append((piece, result))
+        for owner, parts in groups.items():
+            if any(r is None for _, r in parts):
+                continue
+            if len(parts) == 1:
+                merged[owner] = parts[0][1]
+                continue
+            weights = np.array([estimate_tokens(p) for p, _ in parts], dtype=np.float64)
+            vectors = np.array([r for _, r in parts], dtype=np.float64)
+            pooled = weights @ vectors / weights.sum()
+            # 与文档池化一致，平均后的向量模长小于1，归一化后才能与其他向量直接比较
+            norm = np.linalg.norm(pooled)
+            merged[owner] = (pooled / norm if norm else pooled).tolist()
+        return merged
+
+    def get_embeddings(self, texts: List[str], raise_errors: bool = False) -> List[Optional[list]]:
+        """
+        获取embedding(同步版本)，失败的文本在对应位置返回None
+        文本按token数装箱成批次发送，结果按输入顺序返回
+        :param raise_errors: 为True时记录日志后抛出异常，供模型组进行故障转移
+        """
+        pieces, owners = self._prepare(texts)
+        results: List[Optional[list]] = [None] * len(pieces)
+        for indices in self._pack(pieces):
+            batch = [pieces[i] for i in indices]
+            try:
+                response = self._limited_embeddings(batch)
+            except Exception as e:
+                self._log_error(e)
+                if raise_errors:
+                    raise
+                response = None
+            for i, result in zip(indices, self._align(batch, response)):
+                results[i] = result
+        all_embeddings = self._merge(len(texts), pieces, owners, results)
+        return self._check(all_embeddings) if raise_errors else all_embeddings
+
+    async def close_async(self):
+        """释放服务商持有的连接等资源"""
+        pass
 
     def get_dim(self) -> int:
         """获取embedding维数"""
@@ -109,8 +406,7 @@ class Provider:
         """通过实际嵌入请求验证服务可用性"""
         emb = self.get_embedding(TEXT)
         if bool(emb) and isinstance(emb, list):
-            self.dim = len(emb)
-            self.test_embedding=emb
+            self.set_probe_result(emb)
             return True
         else:
             return False
@@ -119,53 +415,40 @@ class Provider:
     async def get_embedding_async(self, text: str) -> Optional[list]:
         """获取embedding(异步版本)"""
         try:
-            response = await self._get_embedding_async(text)
-            return response
-        except httpx.HTTPStatusError as e:
-            logger.error(f"[{self.get_provider_name()}] API错误: {e.response.status_code} - {e.response.text}")
-        except httpx.RequestError as e:
-            logger.error(f"[{self.get_provider_name()}] 网络请求失败: {str(e)}")
-        except requests.exceptions.Timeout:
-            logger.error(f"[{self.get_provider_name()}] 请求超时")
-        except requests.exceptions.ConnectionError:
-            logger.error(f"[{self.get_provider_name()}] 连接错误")
-        except requests.exceptions.SSLError:
-            logger.error(f"[{self.get_provider_name()}] SSL证书验证失败")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[{self.get_provider_name()}] 请求发生异常:{str(e)}")
-        except json.JSONDecodeError:
-            logger.error(f"[{self.get_provider_name()}] 响应数据解析失败")
+            return await self._get_embedding_async(text)
         except Exception as e:
-            logger.error(f"[{self.get_provider_name()}] 未知错误: {str(e)}")
-
-
-
-    async def get_embeddings_async(self, texts: List[str]) -> Optional[List[list]]:
-        """获取embeddings(异步版本)"""
-        all_embeddings = []
-        try:
-            for i in range(0, len(texts), self.batch_size):
-                batch = texts[i:i + self.batch_size]
-                response = await self._get_embeddings_async(batch)
-                if response:
-                    all_embeddings.extend(response)
-            return all_embeddings
-        except httpx.HTTPStatusError as e:
-            logger.error(f"[{self.get_provider_name()}] API错误: {e.response.status_code} - {e.response.text}")
-        except httpx.RequestError as e:
-            logger.error(f"[{self.get_provider_name()}] 网络请求失败: {str(e)}")
-        except requests.exceptions.Timeout:
-            logger.error(f"[{self.get_provider_name()}] 请求超时")
-        except requests.exceptions.ConnectionError:
-            logger.error(f"[{self.get_provider_name()}] 连接错误")
-        except requests.exceptions.SSLError:
-            logger.error(f"[{self.get_provider_name()}] SSL证书验证失败")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[{self.get_provider_name()}] 请求发生异常:{str(e)}")
-        except json.JSONDecodeError:
-            logger.error(f"[{self.get_provider_name()}] 响应数据解析失败")
-        except Exception as e:
-            logger.error(f"[{self.get_provider_name()}] 未知错误: {str(e)}")
+            self._log_error(e)
+
+    async def get_embeddings_async(self, texts: List[str], raise_errors: bool = False,
+                                   timeout: Optional[float] = None) -> List[Optional[list]]:
+        """
+        获取embeddings(异步版本)，文本按token数装箱后各批次并发执行，失败的文本在对应位置返回None
+        :param raise_errors: 为True时记录日志后抛出第一个异常，供模型组进行故障转移
+        :param timeout: 每个批次请求的超时时间（秒），等待限速的时间不计入
+        """
+        pieces, owners = self._prepare(texts)
+        packed = self._pack(pieces)
+        batches = [[pieces[i] for i in indices] for indices in packed]
+        responses = await asyncio.gather(
+            *[self._limited_embeddings_async(batch, timeout) for batch in batches], return_exceptions=True
+        )
+        results: List[Optional[list]] = [None] * len(pieces)
+        error = None
+        for indices, batch, response in zip(packed, batches, responses):
+            if isinstance(response, BaseException):
+                if not isinstance(response, Exception):
+                    raise response
+                self._log_error(response)
+                error = error or response
+                response = None
+            for i, result in zip(indices, self._align(batch, response)):
+                results[i] = result
+        all_embeddings = self._merge(len(texts), pieces, owners, results)
+        if raise_errors:
+            if error is not None:
+                raise error
+            return self._check(all_embeddings)
+        return all_embeddings
 
 
     async def get_dim_async(self) -> int:
@@ -187,8 +470,7 @@ class Provider:
         emb = await self.get_embedding_async(TEXT)
         # 验证返回格式：非空列表且包含浮点数
         if bool(emb) and isinstance(emb, list):
-            self.dim = len(emb)
-            self.test_embedding=emb
+            self.set_probe_result(emb)
             return True
         else:
             return False
@@ -302,7 +584,11 @@ class OpenaiProvider(Provider):
         self.url = config['api_url']
         self.api_key = self.config["api_key"]
 
+        # 仅在配置了该服务商时才导入对应SDK，减少启动耗时
+        import openai
         self.client = openai.OpenAI(api_key=self.api_key, base_url=self.url)
+        # 异步调用由模型组负责重试与限流退避，关闭SDK内置重试以便及时感知429
+        self.async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.url, max_retries=0)
 
 
     def _get_embeddings(self, texts: List[str]) -> Optional[List[list]]:
@@ -310,14 +596,80 @@ class OpenaiProvider(Provider):
         response = self.client.embeddings.create(input=texts, model=self.model)
         return [item.embedding for item in response.data]
 
+    async def _get_embeddings_async(self, texts: List[str]) -> Optional[List[list]]:
+        # 使用异步客户端，避免阻塞事件循环
+        async with self._request_slots:
+            response = await self.async_client.embeddings.create(input=texts, model=self.model)
+        return [item.embedding for item in response.data]
+
+    async def close_async(self):
+        self.client.close()
+        await self.async_client.close()
+
 
 class OllamaProvider(Provider):
     def __init__(self,name:str, config: dict) -> None:
         super().__init__(name,config)
         self.url = config['api_url']
+        # 新版Ollama支持通过/api/embed批量请求，None表示尚未探测
+        self.batch_endpoint: Optional[bool] = None
+        if 'batch_size' not in config:
+            self.batch_size = 32
+        # 连接池参数，所有请求复用长连接
+        self.pool_max_connections = int(config.get("pool_max_connections", 10))
+        self.pool_max_keepalive = int(config.get("pool_max_keepalive", 10))
+        self.keepalive_expiry = float(config.get("keepalive_expiry", 30))
+        self.http2 = bool(config.get("http2", False))
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_max_connections
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """获取长连接异步客户端，首次使用时在当前事件循环中创建"""
+        if self._async_client is None or self._async_client.is_closed:
+            limits = httpx.Limits(
+                max_connections=self.pool_max_connections,
+                max_keepalive_connections=self.pool_max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            )
+            try:
+                self._async_client = httpx.AsyncClient(timeout=30, limits=limits, http2=self.http2)
+            except ImportError:
+                # http2 需要额外安装 h2 库
+                logger.warning(f"[{self.get_provider_name()}] 未安装h2，HTTP/2已禁用")
+                self.http2 = False
+                self._async_client = httpx.AsyncClient(timeout=30, limits=limits)
+        return self._async_client
+
+    @staticmethod
+    def _is_legacy_response(response) -> bool:
+        """
+        旧版Ollama没有/api/embed，返回纯文本的404；新版在模型不存在时也返回404，但带有JSON格式的error
+        """
+        if response.status_code not in (404, 405):
+            return False
+        try:
+            return "error" not in response.json()
+        except ValueError:
+            return True
 
-    def _get_embedding(self, text: str) -> Optional[list]:
-        response = requests.post(
+    def _on_batch_response(self, response) -> Optional[List[list]]:
+        """处理/api/embed的响应，服务端不支持时记录并返回None"""
+        if self.batch_endpoint is None and self._is_legacy_response(response):
+            self.batch_endpoint = False
+            logger.info(f"[{self.get_provider_name()}] 服务端不支持/api/embed，使用逐条请求的/api/embeddings")
+            return None
+        response.raise_for_status()
+        self.batch_endpoint = True
+        return response.json()["embeddings"]
+
+    def _get_embedding_legacy(self, text: str) -> Optional[list]:
+        response = self.session.post(
             f"{self.url}/api/embeddings",
             json={
                 "model": self.model,
@@ -329,15 +681,50 @@ class OllamaProvider(Provider):
         return response.json()["embedding"]
 
     def _get_embeddings(self, texts: List[str]) -> Optional[List[list]]:
-        # Ollama API 不支持批量，逐条处理
+        if self.batch_endpoint is not False:
+            response = self.session.post(
+                f"{self.url}/api/embed",
+                json={"model": self.model, "input": texts},
+                timeout=30
+            )
+            embeddings = self._on_batch_response(response)
+            if embeddings is not None:
+                return embeddings
+        # 旧版Ollama API 不支持批量，逐条处理，失败的文本在对应位置返回None
         results = []
         for text in texts:
-            results.append(self._get_embedding(text))
+            try:
+                results.append(self._get_embedding_legacy(text))
+            except Exception as e:
+                self._log_error(e)
+                results.append(None)
         return results
 
-    async def _get_embedding_async(self, text: str) -> Optional[list]:
-        """获取embedding(异步版本)"""
-        async with httpx.AsyncClient(timeout=30) as client:
+    async def _get_embeddings_async(self, texts: List[str]) -> Optional[List[list]]:
+        client = self._get_async_client()
+        if self.batch_endpoint is not False:
+            async with self._request_slots:
+                response = await client.post(
+                    f"{self.url}/api/embed",
+                    json={"model": self.model, "input": texts}
+                )
+            embeddings = self._on_batch_response(response)
+            if embeddings is not None:
+                return embeddings
+        # 旧版Ollama API 不支持批量，逐条处理，并发数受max_concurrency限制
+        responses = await asyncio.gather(
+            *[self._get_embedding_legacy_async(client, text) for text in texts], return_exceptions=True
+        )
+        results = []
+        for response in responses:
+            if isinstance(response, Exception):
+                self._log_error(response)
+                response = None
+            results.append(response)
+        return results
+
+    async def _get_embedding_legacy_async(self, client: httpx.AsyncClient, text: str) -> list:
+        async with self._request_slots:
             response = await client.post(
                 f"{self.url}/api/embeddings",
                 json={
@@ -345,44 +732,41 @@ class OllamaProvider(Provider):
                     "prompt": text
                 }
             )
-            response.raise_for_status()  # 自动处理4xx/5xx状态码
-            return response.json()["embedding"]
-        
-    async def _get_embeddings_async(self, texts: List[str]) -> Optional[List[list]]:
-        # Ollama API 不支持批量，逐条处理
-        async with httpx.AsyncClient(timeout=30) as client:
-            tasks = []
-            for text in texts:
-                tasks.append(
-                    client.post(
-                        f"{self.url}/api/embeddings",
-                        json={
-                            "model": self.model,
-                            "prompt": text
-                        }
-                    )
-                )
-            responses = await asyncio.gather(*tasks)
-            return [response.json()["embedding"] for response in responses if response.status_code == 200]
+        response.raise_for_status()
+        return response.json()["embedding"]
 
     async def is_available_async(self) -> bool:
         """Ollama双重验证:服务在线+模型有效"""
         try:
             # 先验证服务端点可达性
-            async with httpx.AsyncClient(timeout=5) as client:
-                await client.get(f"{self.url}/api/tags")
+            await self._get_async_client().get(f"{self.url}/api/tags", timeout=5)
             # 再验证模型响应能力
             return await super().is_available_async()
         except httpx.RequestError:
             return False
 
+    async def close_async(self):
+        self.session.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
 class GeminiProvider(Provider):
     def __init__(self,name:str, config: dict) -> None:
         super().__init__(name,config)
         self.api_key = self.config["api_key"]
         self.model = self.config["embed_model"]
-        self.client = genai.Client(api_key=self.api_key)
+        from google import genai
+        # 可选的自定义服务地址，用于反向代理或本地模拟服务
+        self.url = self.config.get("api_url", "")
+        http_options = genai.types.HttpOptions(base_url=self.url) if self.url else None
+        self.client = genai.Client(api_key=self.api_key, http_options=http_options)
 
     def _get_embeddings(self, texts: List[str]) -> Optional[List[list]]:
         response = self.client.models.embed_content(model=self.model, contents=texts)
         return [embedding.values for embedding in response.embeddings]
+
+    async def _get_embeddings_async(self, texts: List[str]) -> Optional[List[list]]:
+        async with self._request_slots:
+            response = await self.client.aio.models.embed_content(model=self.model, contents=texts)
+        return [embedding.values for embedding in response.embeddings]
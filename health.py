@@ -0,0 +1,143 @@
+"""
+health.py
+服务商健康状态记录与后台巡检
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from astrbot.api import logger
+
+
+class ProviderHealth:
+    """
+    单个服务商的健康状态，由实际请求被动更新，空闲时由HealthMonitor主动探测补充
+    连续失败failure_threshold次视为不健康，之后任意一次成功即恢复
+    """
+    def __init__(self, failure_threshold: int = 3, window: int = 20, alpha: float = 0.3):
+        self.failure_threshold = max(1, failure_threshold)
+        self.alpha = alpha
+        self.consecutive_failures = 0
+        self.latency: Optional[float] = None
+        self.last_success: Optional[float] = None
+        self.last_failure: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._outcomes = deque(maxlen=window)
+
+    @property
+    def healthy(self) -> bool:
+        return self.consecutive_failures < self.failure_threshold
+
+    @property
+    def error_rate(self) -> float:
+        """最近window次请求的失败比例"""
+        if not self._outcomes:
+            return 0.0
+        return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    @property
+    def last_activity(self) -> float:
+        return max(self.last_success or 0.0, self.last_failure or 0.0)
+
+    def record_success(self, elapsed: float):
+        self.consecutive_failures = 0
+        self.last_success = time.time()
+        self.latency = elapsed if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * elapsed
+        self._outcomes.append(True)
+
+    def record_failure(self, error: str):
+        self.consecutive_failures += 1
+        self.last_failure = time.time()
+        self.last_error = error
+        self._outcomes.append(False)
+
+    def describe(self) -> str:
+        """/em ls中显示的状态"""
+        status = "(可用)" if self.healthy else "(不可用)"
+        parts = [status]
+        if self.latency is not None:
+            parts.append(f"延迟{self.latency * 1000:.0f}ms")
+        if self._outcomes:
+            parts.append(f"错误率{self.error_rate:.0%}")
+        if self.last_success is not None:
+            parts.append(f"{time.time() - self.last_success:.0f}秒前成功")
+        if not self.healthy and self.last_error:
+            parts.append(f"最近错误: {self.last_error}")
+        return " ".join(parts)
+
+
+class HealthMonitor:
+    """
+    后台定期探测服务商，最近interval秒内有实际请求的服务商不再重复探测
+    每轮间隔与各服务商的探测时间都加入随机抖动，避免同时向所有服务商发起请求
+    """
+    def __init__(self, get_providers: Callable[[], List], interval: float = 60.0, jitter: float = 0.2,
+                 probe_timeout: float = 10.0, on_result: Optional[Callable] = None):
+        self.get_providers = get_providers
+        self.interval = max(1.0, interval)
+        self.jitter = jitter
+        self.probe_timeout = probe_timeout
+        # 每次探测完成后回调(provider, 是否可用)
+        self.on_result = on_result
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """在运行中的事件循环上启动巡检任务，没有事件循环时不启动"""
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._jittered(self.interval))
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"服务商健康检查失败: {str(e)}")
+
+    async def check_all(self):
+        now = time.time()
+        due = [p for p in self.get_providers() if now - p.health.last_activity >= self.interval]
+        await asyncio.gather(*[self._check(p, random.uniform(0, self.jitter * self.interval)) for p in due])
+
+    async def _check(self, provider, delay: float = 0.0):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        health = provider.health
+        was_healthy = health.healthy
+        start = time.time()
+        try:
+            ok = await asyncio.wait_for(provider.is_available_async(), timeout=self.probe_timeout)
+        except asyncio.TimeoutError:
+            ok = False
+            health.record_failure(f"探测超时({self.probe_timeout}秒)")
+        except Exception as e:
+            ok = False
+            health.record_failure(f"{type(e).__name__} {str(e)}")
+        else:
+            # 探测请求成功时已被动记录，探测失败但未经过请求记录时（如服务不可达）在此补记
+            if not ok and (health.last_failure or 0.0) < start:
+                health.record_failure("探测失败")
+        if health.healthy != was_healthy:
+            logger.info(f"服务商 {provider.get_provider_name()} 健康状态变为{health.describe()}")
+        if self.on_result is not None:
+            self.on_result(provider, ok)
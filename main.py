@@ -3,6 +3,7 @@ main.py
 插件主程序
 """
 import asyncio
+import os
 from typing import Optional, List,Union
 
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
@@ -11,6 +12,16 @@ from astrbot.api import logger
 
 from .provider_mapping import get_provider,PROVIDER_CLASS_MAP
 from .model_group import ModelGroupProvider
+from .embedding_cache import PersistentEmbeddingCache, DEFAULT_CACHE_DIR
+from .batch_sizer import BatchSizeStore
+from .probe import ProbeCache, probe_providers
+from .health import HealthMonitor
+from . import similarity
+from .vector_index import VectorIndexService
+from .bulk_job import EmbeddingJob, format_progress
+from .utils import write_text_atomic
+from .metrics import (REGISTRY, PROVIDER_REQUESTS, PROVIDER_LATENCY, PROVIDER_BATCH_SIZE,
+                      GROUP_TIMEOUTS, GROUP_HEDGES, CACHE_LOOKUPS, SCHEDULER_WAIT)
 
 @register("astrbot_plugin_embedding_adapter", "AnYan", "提供对各种服务商的embedding模型支持", "1.0.0")
 class EmbeddingAdapter(Star):
@@ -22,6 +33,18 @@ class EmbeddingAdapter(Star):
         self.unable_groups = []
         self.current_provider_group = None
 
+        # 持久化缓存，所有模型组共享同一个数据库
+        self.persistent_cache = None
+        cache_config = config.get("cache", {})
+        if cache_config.get("persistent", False):
+            try:
+                self.persistent_cache = PersistentEmbeddingCache(
+                    cache_config.get("persistent_path", ""),
+                    cache_config.get("persistent_max_entries", 100000),
+                )
+            except Exception as e:
+                logger.error(f"持久化缓存初始化失败: {str(e)}")
+
         # 严格匹配服务商名称
         for api_name in PROVIDER_CLASS_MAP:  # 预定义允许的服务商
             if api_name in config:
@@ -34,43 +57,86 @@ class EmbeddingAdapter(Star):
                     api_keys = provider_config.get("api_key", "").split(",")
                     embed_models = provider_config.get("embed_model", "").split(",")
                     batch_size = provider_config.get("batch_size", "1").split(",")
+                    rpm = str(provider_config.get("rpm", "0")).split(",")
+                    tpm = str(provider_config.get("tpm", "0")).split(",")
 
                     api_urls = [u.strip() for u in api_urls if u.strip()]
                     api_keys = [k.strip() for k in api_keys if k.strip()]
                     embed_models = [m.strip() for m in embed_models if m.strip()]
                     batch_sizes = [b.strip() for b in batch_size if b.strip()]
+                    rpms = [r.strip() for r in rpm if r.strip()]
+                    tpms = [t.strip() for t in tpm if t.strip()]
 
                     # 以最短长度为准，初始化多个openai provider
                     for idx in range(min(len(api_urls), len(api_keys), len(embed_models))):
-                        multi_provider_config = {
+                        # 其余参数（如并发上限）由各组共享
+                        multi_provider_config = dict(provider_config)
+                        multi_provider_config.update({
                             "api_url": api_urls[idx],
                             "api_key": api_keys[idx],
                             "embed_model": embed_models[idx],
-                            "batch_size": batch_sizes[idx] if idx < len(batch_sizes) else "1",
-                        }
+                            "batch_size": batch_sizes[idx] if idx < len(batch_sizes) else (batch_sizes[0] if len(batch_sizes) == 1 else "1"),
+                            # 只填写一个限速值时所有key共用该值
+                            "rpm": rpms[idx] if idx < len(rpms) else (rpms[0] if len(rpms) == 1 else "0"),
+                            "tpm": tpms[idx] if idx < len(tpms) else (tpms[0] if len(tpms) == 1 else "0"),
+                        })
                         provider_name = f"openai_{idx+1}" if len(api_urls) > 1 else "openai"
                         self._provider_init(api_name,provider_name, multi_provider_config)
                 else:
                     provider_name=api_name
                     self._provider_init(api_name,provider_name, provider_config)
                     
+        # 恢复自动批量模式下学习到的批量大小
+        self.batch_size_store = BatchSizeStore(os.path.join(DEFAULT_CACHE_DIR, "batch_sizes.json"))
+        for provider in self.providers.values():
+            if provider.batch_sizer is not None:
+                provider.batch_sizer.load(self.batch_size_store.get(provider.batch_key()))
+
+        # 并发探测各服务商，命中缓存的服务商不再发送请求
+        probe_config = config.get("probe", {})
+        self.probe_cache = None
+        if probe_config.get("cache", True):
+            self.probe_cache = ProbeCache(os.path.join(DEFAULT_CACHE_DIR, "probe_cache.json"),
+                                          ttl=probe_config.get("cache_ttl", 86400))
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        available = probe_providers(list(self.providers.values()), self.probe_cache,
+                                    deadline=probe_config.get("startup_timeout", 15),
+                                    on_late=self._on_late_probe)
+        # 按配置顺序加入模型组，保证默认服务商不受探测完成顺序影响
         for provider_name in self.providers:
-            # 如果可用则添加到groups中
-            if self.providers[provider_name].is_available():
-                has_group = False
-                for goup_name, group in self.groups.items():
-                    if group.add_provider(self.providers[provider_name]):
-                        has_group = True
-                        break
-
-                if not has_group:
-                    # 如果没有找到对应的group，则创建一个新的group
-                    group_name = self.providers[provider_name].get_model_name()
-                    self.groups[group_name] = ModelGroupProvider(group_name,[self.providers[provider_name]])
-                    logger.info(f"成功创建新的模型组: {group_name}")
+            if available.get(provider_name):
+                self._attach_provider(provider_name)
             else:
                 self.unable_groups.append(provider_name)
-                            
+
+        # 正在运行的批量向量化任务的输出路径
+        self._running_jobs = set()
+
+        # 供其他插件共用的向量集合
+        self.vector_index = VectorIndexService(os.path.join(DEFAULT_CACHE_DIR, "collections"))
+        # 定期保存有修改的集合，避免进程异常退出时丢失terminate前的全部写入
+        self.collection_save_interval = config.get("vector_index", {}).get("save_interval", 60)
+        self.vector_index.start_autosave(self.collection_save_interval)
+
+        # 后台健康检查，/em ls与调度器读取其记录的状态
+        health_config = config.get("health", {})
+        for provider in self.providers.values():
+            provider.health.failure_threshold = max(1, health_config.get("failure_threshold", 3))
+        self.health_monitor = HealthMonitor(
+            lambda: list(self.providers.values()),
+            interval=health_config.get("interval", 60),
+            jitter=health_config.get("jitter", 0.2),
+            probe_timeout=health_config.get("probe_timeout", 10),
+            on_result=self._on_health_result,
+        )
+        self.health_monitor.start()
+
+        # 运行状态类指标在输出时读取
+        self.metrics_config = config.get("metrics", {})
+        self._register_gauges()
 
         # 设置目前服务商
         if config.get("whichgroup"):
@@ -80,6 +146,58 @@ class EmbeddingAdapter(Star):
                 logger.warning(f"配置的whichgroup {config['whichgroup']} 未在已初始化的groups中")
 
 
+    def _attach_provider(self, provider_name: str):
+        """将可用的服务商加入test_embedding一致的模型组，没有则新建模型组"""
+        provider = self.providers[provider_name]
+        for group in self.groups.values():
+            if group.add_provider(provider):
+                return
+        # 如果没有找到对应的group，则创建一个新的group
+        group_name = provider.get_model_name()
+        self.groups[group_name] = ModelGroupProvider(group_name, [provider],
+                                                     persistent_cache=self.persistent_cache,
+                                                     config=self.config)
+        logger.info(f"成功创建新的模型组: {group_name}")
+
+    def _recover_provider(self, provider):
+        """之前不可用的服务商探测成功后加入模型组"""
+        if provider.name not in self.unable_groups:
+            return
+        self.unable_groups.remove(provider.name)
+        self._attach_provider(provider.name)
+        if self.current_provider_group is None and self.config.get("whichgroup") in self.groups:
+            self.current_provider_group = self.groups[self.config["whichgroup"]]
+        logger.info(f"服务商 {provider.name} 探测成功，已加入模型组")
+
+    def _on_late_probe(self, provider, ok: bool):
+        """启动时探测超时的服务商完成探测，在探测线程中调用"""
+        if not ok:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._recover_provider, provider)
+        else:
+            self._recover_provider(provider)
+
+    def _on_health_result(self, provider, ok: bool):
+        if ok:
+            self._recover_provider(provider)
+
+    def _register_gauges(self):
+        groups = self.groups
+        REGISTRY.gauge("embedding_memory_cache_entries", "内存缓存条目数", ("group",),
+                       lambda: [({"group": n}, len(g._embedding_cache)) for n, g in groups.items()])
+        REGISTRY.gauge("embedding_memory_cache_bytes", "内存缓存估计占用字节数", ("group",),
+                       lambda: [({"group": n}, g._embedding_cache.nbytes) for n, g in groups.items()])
+        REGISTRY.gauge("embedding_persistent_cache_entries", "持久化缓存条目数", (),
+                       lambda: [({}, len(self.persistent_cache))] if self.persistent_cache is not None else [])
+        REGISTRY.gauge("embedding_group_pending_texts", "正在等待结果的去重文本数", ("group",),
+                       lambda: [({"group": n}, len(g._inflight)) for n, g in groups.items()])
+        REGISTRY.gauge("embedding_provider_inflight", "正在执行的请求数", ("group", "provider"),
+                       lambda: [({"group": n, "provider": p.get_provider_name()}, s.inflight)
+                                for n, g in groups.items() for p, s in zip(g.providers, g.scheduler.stats)])
+        REGISTRY.gauge("embedding_provider_healthy", "服务商是否可用", ("provider",),
+                       lambda: [({"provider": n}, int(p.health.healthy)) for n, p in self.providers.items()])
+
     def _provider_init(self, api_name: str, group_name:str, provider_config: dict):
         try:
             provider = get_provider(api_name, group_name, provider_config)
@@ -111,6 +229,18 @@ class EmbeddingAdapter(Star):
             raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
         return self.current_provider_group.get_embeddings(texts)
 
+    def get_embedding_array(self, text: str):
+        """获取float32格式的embedding向量"""
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        return self.current_provider_group.get_embedding_array(text)
+
+    def get_embeddings_array(self, texts: List[str]):
+        """获取(n, dim)的float32 embedding矩阵"""
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        return self.current_provider_group.get_embeddings_array(texts)
+
     def get_dim(self):
         """获取embedding维数"""
         if self.current_provider_group is None:
@@ -149,6 +279,53 @@ class EmbeddingAdapter(Star):
             raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
         return await self.current_provider_group.get_embeddings_async(texts)
 
+    async def get_embedding_array_async(self, text: str, fuzzy: bool = True):
+        """
+        获取float32格式的embedding向量
+        :param fuzzy: 为False时内存缓存只做精确匹配，不返回近似文本的向量
+        """
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        return await self.current_provider_group.get_embedding_array_async(text, fuzzy)
+
+    async def get_embeddings_array_async(self, texts: List[str], fuzzy: bool = True):
+        """
+        获取(n, dim)的float32 embedding矩阵
+        :param fuzzy: 为False时内存缓存只做精确匹配，不返回近似文本的向量
+        """
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        return await self.current_provider_group.get_embeddings_array_async(texts, fuzzy)
+
+    async def get_document_embeddings_async(self, documents: List[str], chunk_tokens: Optional[int] = None,
+                                            overlap_tokens: Optional[int] = None, pooling: str = "mean"):
+        """
+        获取长文档的embedding，文档自动切分为重叠的块，所有块在一次调度中统一请求
+        :param pooling: mean/weighted返回每个文档合并后的单位向量，none返回每个块的文本与向量
+        """
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        return await self.current_provider_group.get_document_embeddings_async(
+            documents, chunk_tokens, overlap_tokens, pooling)
+
+    async def get_document_embedding_async(self, document: str, chunk_tokens: Optional[int] = None,
+                                           overlap_tokens: Optional[int] = None, pooling: str = "mean"):
+        """获取单个长文档的embedding"""
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        return await self.current_provider_group.get_document_embedding_async(
+            document, chunk_tokens, overlap_tokens, pooling)
+
+    async def aembed_stream(self, texts, chunk_size: int = 256, max_pending: int = 4, ordered: bool = False):
+        """
+        流式获取embedding，texts可以是普通或异步可迭代对象，逐条产出(下标, float32向量)
+        同时处理的文本不超过chunk_size*max_pending条，适合向量化大量文本
+        """
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        async for item in self.current_provider_group.aembed_stream(texts, chunk_size, max_pending, ordered):
+            yield item
+
     async def get_dim_async(self):
         """获取embedding维数"""
         if self.current_provider_group is None:
@@ -160,6 +337,125 @@ class EmbeddingAdapter(Star):
         if self.current_provider_group is None:
             raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
         return await self.current_provider_group.is_available_async()
+
+    async def build_embeddings(self, input_path: str, output_path: str = "", text_field: str = "text",
+                               on_progress=None) -> dict:
+        """
+        向量化整个语料文件（每行一条文本，或JSONL中的text_field字段），结果按行写入<output_path>.f32
+        中断后以相同参数再次调用会从上次保存的进度继续
+        :param output_path: 输出路径前缀，留空则保存在插件数据目录的jobs下
+        :return: 进度信息，包含rows/failed/rate/done等字段，存在失败的文本时done为False，再次调用会重试这些文本
+        """
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        job = EmbeddingJob(self.current_provider_group, input_path, output_path, text_field=text_field)
+        if job.output_path in self._running_jobs:
+            raise ValueError(f"任务{job.output_path}正在运行")
+        self._running_jobs.add(job.output_path)
+        try:
+            return await job.run(on_progress)
+        finally:
+            self._running_jobs.discard(job.output_path)
+
+    def get_collection(self, name: str, backend: str = "auto"):
+        """
+        获取当前模型组下的命名向量集合，不存在时创建
+        :param backend: auto(数据量大时自动启用IVF近似检索)、flat(精确检索)或ivf
+        :raises ValueError: 集合属于其他模型时
+        """
+        if self.current_provider_group is None:
+            raise ValueError("当前没有可用的embedding服务商，请使用 /em select 命令选择一个服务商")
+        group = self.current_provider_group
+        index_config = self.config.get("vector_index", {})
+        return self.vector_index.get_collection(
+            name, group.get_dim(), group.fingerprint, backend=backend,
+            nprobe=index_config.get("nprobe", 16), ivf_threshold=index_config.get("ivf_threshold", 20000),
+        )
+
+    async def collection_upsert_async(self, name: str, ids: List[str], texts: List[str],
+                                      metadatas: Optional[List[dict]] = None):
+        """将文本向量化后写入集合，id已存在时覆盖"""
+        collection = self.get_collection(name)
+        vectors = await self.get_embeddings_array_async(texts, fuzzy=False)
+        collection.upsert(ids, vectors, metadatas)
+        self.vector_index.start_autosave(self.collection_save_interval)
+
+    async def collection_search_async(self, name: str, query: str, k: int = 5) -> List[dict]:
+        """在集合中检索与query最相似的k条数据，返回[{"id", "score", "metadata"}]"""
+        collection = self.get_collection(name)
+        return collection.search(await self.get_embedding_array_async(query, fuzzy=False), k)
+
+    def collection_delete(self, name: str, ids: List[str]) -> int:
+        """从集合中删除数据，返回实际删除的数量"""
+        return self.get_collection(name).delete(ids)
+
+    def save_collection(self, name: str):
+        """
+        立即将集合写入磁盘，未修改时不写文件
+        集合默认每vector_index.save_interval秒自动保存一次，需要确保写入已落盘时调用
+        :raises ValueError: 集合不存在时
+        """
+        self.vector_index.save_collection(name)
+
+    def list_collections(self) -> List[str]:
+        return self.vector_index.list_collections()
+
+    def drop_collection(self, name: str) -> bool:
+        """删除整个集合及其文件"""
+        return self.vector_index.drop_collection(name)
+
+    def get_stats(self) -> dict:
+        """
+        各模型组与服务商的运行统计
+        :return: {模型组: {"cache": {...}, "queue_wait": {...}, "providers": {服务商: {...}}}}
+        """
+        stats = {}
+        for group_name, group in self.groups.items():
+            lookups = {r: CACHE_LOOKUPS.get(group=group_name, result=r)
+                       for r in ("hit", "fuzzy_hit", "persistent_hit", "miss")}
+            total = sum(lookups.values())
+            providers = {}
+            for provider, s in zip(group.providers, group.scheduler.stats):
+                name = provider.get_provider_name()
+                providers[name] = {
+                    "requests": sum(PROVIDER_REQUESTS.get(provider=name, outcome=o)
+                                    for o in ("ok", "error", "rate_limited", "rejected", "client_error")),
+                    "errors": PROVIDER_REQUESTS.get(provider=name, outcome="error"),
+                    "client_errors": PROVIDER_REQUESTS.get(provider=name, outcome="client_error"),
+                    "rejected": PROVIDER_REQUESTS.get(provider=name, outcome="rejected"),
+                    "rate_limited": PROVIDER_REQUESTS.get(provider=name, outcome="rate_limited"),
+                    "timeouts": GROUP_TIMEOUTS.get(group=group_name, provider=name),
+                    "inflight": s.inflight,
+                    "healthy": provider.health.healthy,
+                    "latency": PROVIDER_LATENCY.summary(provider=name),
+                    "batch_size": PROVIDER_BATCH_SIZE.summary(provider=name),
+                }
+            stats[group_name] = {
+                "cache": dict(lookups, hit_rate=(total - lookups["miss"]) / total if total else None,
+                              entries=len(group._embedding_cache), bytes=group._embedding_cache.nbytes),
+                "pending": len(group._inflight),
+                "queue_wait": SCHEDULER_WAIT.summary(group=group_name),
+                "hedges": {r: GROUP_HEDGES.get(group=group_name, result=r)
+                           for r in ("won", "lost", "failed", "no_budget", "no_provider")},
+                "providers": providers,
+            }
+        return stats
+
+    def get_metrics_prometheus(self) -> str:
+        """Prometheus文本格式的全部指标"""
+        return REGISTRY.render_prometheus()
+
+    def cosine_similarity(self, query, vectors, normalized: bool = False):
+        """计算query与(n, dim)矩阵每一行的余弦相似度，返回float32数组"""
+        return similarity.cosine_similarity(query, vectors, normalized=normalized)
+
+    def top_k(self, query, vectors, k: int, normalized: bool = False):
+        """返回与query最相似的k个向量的(下标, 相似度)，按相似度从高到低排列"""
+        return similarity.top_k(query, vectors, k, normalized=normalized)
+
+    def normalize(self, vectors):
+        """按行归一化向量，存储归一化后的矩阵可在检索时传入normalized=True"""
+        return similarity.normalize(vectors)
     
 
 
@@ -172,24 +468,17 @@ class EmbeddingAdapter(Star):
     @embedding_manager.command("list", alias={'ls'})
     async def list_groupgroups(self, event: AstrMessageEvent):
         """列出所有可用服务商 /em ls"""
+        self.health_monitor.start()
         if not self.groups:
             yield event.plain_result("未配置任何有效的embedding服务商")
         reply_list=[]
         for group_name, group in self.groups.items():
             current_flag = "[√]" if group == self.current_provider_group else "[  ]"
             reply_list.append(f"{current_flag} {group_name}:")
-            availability_tasks = {
-                provider.get_provider_name: provider.is_available_async()
-                for provider in group.providers
-            }
-            results = await asyncio.gather(*availability_tasks.values(), return_exceptions=True)
-            # 构建状态信息
-            i=0
-            for provider, available in zip(group.providers, results):
-                is_available = "(可用)" if available else "(不可用)"
+            # 状态来自健康检查记录，不发送请求
+            for i, provider in enumerate(group.providers):
                 current_flag2 = "[√]" if i == group.default_provider_index else "[  ]"
-                reply_list.append(f"\t({i}) {current_flag2} {provider.get_provider_name()} {is_available}")
-                i+=1
+                reply_list.append(f"\t({i}) {current_flag2} {provider.get_provider_name()} {provider.health.describe()}")
         reply_list.append("不可用的服务商:")
         for provider_name in self.unable_groups:
             reply_list.append(f"\t{provider_name}")
@@ -214,6 +503,91 @@ class EmbeddingAdapter(Star):
         else:
             yield event.plain_result(f"切换失败，不存在服务商：{name}")
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @embedding_manager.command("build")
+    async def build_corpus(self, event: AstrMessageEvent, file: str, output: str = ""):
+        """批量向量化语料文件，中断后再次执行会继续 /em build <文件> [输出路径]"""
+        def log_progress(progress: dict):
+            logger.info(f"向量化{file}: {format_progress(progress)}")
+
+        yield event.plain_result(f"开始向量化{file}")
+        try:
+            progress = await self.build_embeddings(file, output, on_progress=log_progress)
+        except ValueError as e:
+            yield event.plain_result(f"任务无法开始: {str(e)}")
+            return
+        except Exception as e:
+            logger.error(f"向量化{file}中断: {str(e)}")
+            yield event.plain_result(f"任务中断，已保存进度，再次执行相同命令即可继续: {str(e)}")
+            return
+        if not progress["done"]:
+            yield event.plain_result(f"向量化结束，{format_progress(progress)}，再次执行相同命令会重试失败的文本")
+            return
+        yield event.plain_result(f"向量化完成，{format_progress(progress)}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @embedding_manager.command("stats")
+    async def show_stats(self, event: AstrMessageEvent, fmt: str = ""):
+        """查看运行统计，加prom参数时导出Prometheus文本 /em stats [prom]"""
+        if fmt == "prom":
+            path = self.metrics_config.get("prometheus_file") or os.path.join(DEFAULT_CACHE_DIR, "metrics.prom")
+            try:
+                # node_exporter的textfile采集可能随时读取，整体替换避免读到不完整的文件
+                write_text_atomic(path, self.get_metrics_prometheus())
+            except OSError as e:
+                yield event.plain_result(f"导出失败: {str(e)}")
+                return
+            yield event.plain_result(f"已导出到{path}")
+            return
+        stats = self.get_stats()
+        if not stats:
+            yield event.plain_result("未配置任何有效的embedding服务商")
+            return
+        def ms(v):
+            return f"{v * 1000:.0f}ms" if v is not None else "-"
+
+        reply_list = []
+        for group_name, group in stats.items():
+            cache = group["cache"]
+            hit_rate = f"{cache['hit_rate']:.0%}" if cache["hit_rate"] is not None else "-"
+            reply_list.append(f"{group_name}:")
+            reply_list.append(f"\t缓存: 命中率{hit_rate} (精确{cache['hit']:.0f} 近似{cache['fuzzy_hit']:.0f} "
+                              f"持久化{cache['persistent_hit']:.0f} 未命中{cache['miss']:.0f})，"
+                              f"{cache['entries']}条/{cache['bytes'] / 1024 / 1024:.1f}MB")
+            wait = group["queue_wait"] or {}
+            reply_list.append(f"\t调度等待: 平均{ms(wait.get('mean'))} p95 {ms(wait.get('p95'))}，"
+                              f"等待结果的文本{group['pending']}条")
+            hedges = group["hedges"]
+            if any(hedges.values()):
+                sent = hedges["won"] + hedges["lost"] + hedges["failed"]
+                reply_list.append(f"\t对冲: 发送{sent:.0f} 胜出{hedges['won']:.0f} 失败{hedges['failed']:.0f} "
+                                  f"预算不足{hedges['no_budget']:.0f} 无空闲服务商{hedges['no_provider']:.0f}")
+            for name, p in group["providers"].items():
+                latency = p["latency"] or {}
+                batch = p["batch_size"] or {}
+                avg_batch = f"{batch['mean']:.1f}" if batch else "-"
+                reply_list.append(
+                    f"\t{name}{'' if p['healthy'] else '(不可用)'}: 请求{p['requests']:.0f} 失败{p['errors']:.0f} "
+                    f"输入有误{p['client_errors']:.0f} 超时{p['timeouts']:.0f} 限流{p['rate_limited']:.0f} 进行中{p['inflight']} "
+                    f"平均批量{avg_batch} 延迟p50 {ms(latency.get('p50'))} p95 {ms(latency.get('p95'))}")
+        yield event.plain_result("\n".join(reply_list))
+
     async def terminate(self):
         """可选择实现异步的插件销毁方法，当插件被卸载/停用时会调用。"""
-        pass
\ No newline at end of file
+        await self.health_monitor.stop()
+        await self.vector_index.stop_autosave()
+        for provider_name, provider in self.providers.items():
+            try:
+                await provider.close_async()
+            except Exception as e:
+                logger.error(f"服务商 {provider_name} 关闭失败: {str(e)}")
+        try:
+            self.batch_size_store.save({
+                provider.batch_key(): provider.batch_sizer.state()
+                for provider in self.providers.values() if provider.batch_sizer is not None
+            })
+        except OSError as e:
+            logger.error(f"保存批量参数失败: {str(e)}")
+        self.vector_index.save_all()
+        if self.persistent_cache is not None:
+            self.persistent_cache.close()
\ No newline at end of file
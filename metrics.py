@@ -0,0 +1,195 @@
+"""
+metrics.py
+运行指标统计，可输出为Prometheus文本格式
+"""
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def items(self) -> List[Tuple[Dict[str, str], float]]:
+        with self._lock:
+            return [(dict(zip(self.labelnames, k)), v) for k, v in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # 标签 -> [各区间计数..., 总和, 总数]，区间计数不累加，输出时再累加
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def summary(self, **labels) -> Optional[dict]:
+        """返回count/mean/p50/p95/p99，分位数在所在区间内线性插值估计"""
+        data = self._values.get(self._key(labels))
+        if not data or not data[-1]:
+            return None
+        count = data[-1]
+        return {
+            "count": count,
+            "mean": data[-2] / count,
+            "p50": self._quantile(data, 0.5),
+            "p95": self._quantile(data, 0.95),
+            "p99": self._quantile(data, 0.99),
+        }
+
+    def _quantile(self, data: list, q: float) -> float:
+        target = q * data[-1]
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            if data[i] and seen + data[i] >= target:
+                return lower + (bound - lower) * (target - seen) / data[i]
+            seen += data[i]
+            lower = bound
+        # 落在最后的+Inf区间时只能返回最大的区间上界
+        return self.buckets[-1]
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        with self._lock:
+            return [dict(zip(self.labelnames, k)) for k in self._values]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, data in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(data[-2])}")
+            lines.append(f"{self.name}_count{labels} {data[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """输出时通过回调读取当前值，回调返回[(标签, 值)]"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 collect: Optional[Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in (self.collect() if self.collect is not None else []):
+            lines.append(f"{self.name}{_label_text(self.labelnames, self._key(labels))} {_format_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = (), collect=None) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, collect))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 插件内共用的指标
+REGISTRY = MetricsRegistry()
+PROVIDER_REQUESTS = REGISTRY.counter(
+    "embedding_provider_requests_total", "发送给服务商的请求数", ("provider", "outcome"))
+PROVIDER_LATENCY = REGISTRY.histogram(
+    "embedding_provider_request_seconds", "服务商请求耗时", ("provider",))
+PROVIDER_BATCH_SIZE = REGISTRY.histogram(
+    "embedding_provider_batch_texts", "每个请求包含的文本数", ("provider",), SIZE_BUCKETS)
+GROUP_TIMEOUTS = REGISTRY.counter(
+    "embedding_group_timeouts_total", "模型组内批次超时次数", ("group", "provider"))
+GROUP_ERRORS = REGISTRY.counter(
+    "embedding_group_batch_errors_total", "模型组内批次失败次数（含重试）", ("group", "provider"))
+GROUP_HEDGES = REGISTRY.counter(
+    "embedding_group_hedged_requests_total",
+    "对冲请求次数，result为won(对冲先返回)、lost(主请求先返回)、failed、no_budget或no_provider", ("group", "result"))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "embedding_cache_lookups_total", "缓存查询次数", ("group", "result"))
+SCHEDULER_WAIT = REGISTRY.histogram(
+    "embedding_scheduler_wait_seconds", "等待空闲provider槽位的时间", ("group",), WAIT_BUCKETS)
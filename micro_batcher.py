@@ -0,0 +1,64 @@
+"""
+micro_batcher.py
+合并并发的单条embedding请求
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from astrbot.api import logger
+
+
+class MicroBatcher:
+    """
+    收集短时间窗口内到达的单条文本请求，凑成一批后一次性提交，再把结果分发给各调用方
+    窗口到期或批次已满时立即提交，flush返回的结果为异常时只有该文本的调用方收到异常
+    """
+    def __init__(self, flush: Callable[[List[str]], Awaitable[Dict[str, object]]],
+                 window: float = 0.005, max_batch: int = 64):
+        self._flush = flush
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 持有后台任务的引用，防止被垃圾回收
+        self._tasks = set()
+
+    async def submit(self, text: str):
+        """提交一条文本，返回其向量，失败时返回None"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.create_task(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in pending]
+        try:
+            results = await self._flush(texts)
+        except Exception as e:
+            logger.error(f"合并请求失败: {str(e)}")
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in pending:
+            if future.done():
+                continue
+            result = results.get(text)
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -1,34 +1,99 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterable, AsyncIterator, Iterable, Tuple, Union
 import asyncio
+import random
+from collections import deque
 import time
 
+import numpy as np
+
 from astrbot.api import logger
 
 from .utils import *
 from .embedding_providers import Provider
+from .embedding_cache import PersistentEmbeddingCache, MemoryEmbeddingCache
+from .micro_batcher import MicroBatcher
+from .scheduler import ProviderScheduler, NoAvailableProviderError, HedgeBudget
+from .rate_limiter import RateLimitedError, is_client_error
+from .metrics import CACHE_LOOKUPS, GROUP_ERRORS, GROUP_HEDGES, GROUP_TIMEOUTS
+
+def _to_list(vec: Optional[np.ndarray]) -> Optional[List[float]]:
+    return vec.tolist() if vec is not None else None
+
+
+class _InflightFetch:
+    """一次正在进行的未缓存文本查询，由所有等待其中文本结果的调用方共享"""
+    def __init__(self, task: asyncio.Task, futures: Dict[str, asyncio.Future]):
+        self.task = task
+        self.futures = futures
+        # 正在等待该查询的调用方数量，降为0时才取消查询
+        self.waiters = 0
+
 
 class ModelGroupProvider:
     """
     聚合所有test_embedding一致的provider，暴露EmbeddingAdapter所有接口
     """
-    def __init__(self, name:str, providers: List[Provider],default_provider_index:int=0):
+    def __init__(self, name:str, providers: List[Provider],default_provider_index:int=0,
+                 persistent_cache: Optional[PersistentEmbeddingCache]=None, config: Optional[dict]=None):
         self.name=name
         if not providers:
             raise ValueError("ModelGroupProvider初始化时providers不能为空")
         self.providers = providers
         self.test_embedding = providers[0].get_test_embedding()
-        self._embedding_cache = {}
+        # 持久化缓存，以test_embedding指纹区分同名的不同模型
+        self.persistent_cache = persistent_cache
+        self.fingerprint = vec_fingerprint(self.test_embedding)
         
         
+        config = config or {}
+        cache_config = config.get("cache", {})
         # 缓存命中机制参数
-        self._cache_expire = 20  # 秒
+        self._cache_expire = cache_config.get("memory_expire", 20)  # 秒
         self.epsilon = 1e-6
         self.str_threshold = 0.9
+        self._embedding_cache = MemoryEmbeddingCache(
+            self._cache_expire,
+            self.str_threshold,
+            max_entries=cache_config.get("memory_max_entries", 2000),
+            max_bytes=int(cache_config.get("memory_max_mb", 64) * 1024 * 1024),
+        )
+        scheduler_config = config.get("scheduler", {})
         # 负载均衡参数
         self.default_provider_index = default_provider_index
         self.balance_threshold = 10
-        self.batch_size = 8
-        self.try_count_limit = 10
+        self.try_count_limit = scheduler_config.get("max_retries", 3)
+        self.retry_backoff = scheduler_config.get("retry_backoff", 0.2)  # 首次重试前的等待时间（秒）
+        self.rate_limit_retries = scheduler_config.get("rate_limit_retries", 10)
+        self.request_timeout = scheduler_config.get("request_timeout", 30)  # 每个批次超时时间（秒），不含等待限速的时间
+        self.scheduler = ProviderScheduler(
+            len(providers),
+            name=name,
+            default_index=default_provider_index,
+            max_inflight=scheduler_config.get("max_inflight_per_provider", 2),
+            breaker_threshold=scheduler_config.get("breaker_failure_threshold", 3),
+            breaker_timeout=scheduler_config.get("breaker_reset_timeout", 30),
+            limiters=[p.rate_limiter for p in providers],
+            healths=[p.health for p in providers],
+        )
+
+        # 对冲请求：少量文本的请求超过provider延迟分位数仍未返回时，向另一个空闲provider再发送一次
+        self.hedge = scheduler_config.get("hedge", False)
+        self.hedge_max_texts = scheduler_config.get("hedge_max_texts", 8)
+        self.hedge_percentile = scheduler_config.get("hedge_percentile", 0.95)
+        self.hedge_min_delay = scheduler_config.get("hedge_min_delay", 0.05)  # 秒
+        self.hedge_budget = HedgeBudget(scheduler_config.get("hedge_budget", 0.1))
+
+        # 正在查询中的文本 -> 所属的查询，相同文本的并发请求共享一次调用
+        self._inflight: Dict[str, _InflightFetch] = {}
+
+        # 合并并发的单条异步请求
+        self._batcher: Optional[MicroBatcher] = None
+        if scheduler_config.get("micro_batch", False):
+            self._batcher = MicroBatcher(
+                self._flush_micro_batch,
+                window=scheduler_config.get("micro_batch_window_ms", 5) / 1000,
+                max_batch=scheduler_config.get("micro_batch_max", 64),
+            )
 
     def add_provider(self, provider:Provider):
         """
@@ -42,6 +107,7 @@ class ModelGroupProvider:
             logger.info(f"添加provider: {provider.get_provider_name()}到{self.name}，相似度为{vec_similarity(self.test_embedding ,provider.get_test_embedding())}")
             if vec_similarity(self.test_embedding ,provider.get_test_embedding())>1-self.epsilon:
                 self.providers.append(provider)
+                self.scheduler.add_provider(provider.rate_limiter, provider.health)
                 return True
             else:
                 return False
@@ -57,53 +123,112 @@ class ModelGroupProvider:
         if index < 0 or index >= len(self.providers):
             raise ValueError("provider索引越界")
         self.default_provider_index = index
+        self.scheduler.default_index = index
 
-    def _get_from_cache(self, text: str):
-        for k, (ts, v) in self._embedding_cache.items():
-            if str_similarity(k, text) > self.str_threshold:
-                # 如果缓存的文本和当前文本相似度大于0.9，则返回缓存的值
-                logger.info(f"从缓存中获取embedding: {k} -> {text}")
-                return v
-        return None
+    def _get_from_cache(self, text: str, fuzzy: bool = True):
+        # 精确命中优先，fuzzy为True时其次返回相似度大于str_threshold的缓存文本的值
+        # 返回(向量, hit/fuzzy_hit/miss)
+        return self._embedding_cache.lookup(text, fuzzy)
 
     def _set_cache(self, text: str, value):
-        self._embedding_cache[text] = (time.time(), value)
-
-    def _cleanup_cache(self):
-        now = time.time()
-        expired_cache = [k for k, (ts, _) in self._embedding_cache.items() if now - ts >= self._cache_expire]
-        for k in expired_cache:
-            del self._embedding_cache[k]
-
-
+        self._embedding_cache.set(text, value)
 
-    def get_embedding(self, text: str):
-        self._cleanup_cache()
-        cached = self._get_from_cache(text)
-        if cached is not None:
-            return cached
-
-        result = self.providers[self.default_provider_index].get_embedding(text)
-        self._set_cache(text, result)
-        return result
-
-    def get_embeddings(self, texts: List[str]):
+    def _lookup_cache(self, texts: List[str], fuzzy: bool = True, record_misses: bool = True):
+        """
+        依次查询内存缓存和持久化缓存
+        :param fuzzy: 为False时内存缓存只做精确匹配。近似匹配只比较字符集合，长英文文本之间几乎总会命中，
+                      文档分块、批量任务等需要逐条准确结果的场景应关闭
+        :param record_misses: 未命中的文本之后还会再次查询时传入False，避免同一次请求计入两次miss
+        :return: (命中的 文本->向量 映射, 未命中的文本列表)
+        """
         self._cleanup_cache()
-        unique_texts = list(dict.fromkeys(texts))
         cache_map = {}
         uncached_texts = []
-        for t in unique_texts:
-            cached = self._get_from_cache(t)
+        results = {"hit": 0, "fuzzy_hit": 0, "persistent_hit": 0, "miss": 0}
+        for t in texts:
+            cached, result = self._get_from_cache(t, fuzzy)
             if cached is not None:
                 cache_map[t] = cached
+                results[result] += 1
             else:
                 uncached_texts.append(t)
+        if uncached_texts and self.persistent_cache is not None:
+            found = self.persistent_cache.get_many(self.name, self.fingerprint, uncached_texts)
+            for t, v in found.items():
+                self._set_cache(t, v)
+                cache_map[t] = v
+            uncached_texts = [t for t in uncached_texts if t not in found]
+            results["persistent_hit"] = len(found)
+        if record_misses:
+            results["miss"] = len(uncached_texts)
+        for result, count in results.items():
+            if count:
+                CACHE_LOOKUPS.inc(count, group=self.name, result=result)
+        return cache_map, uncached_texts
+
+    def _store_results(self, texts: List[str], results, cache_map: dict):
+        """将provider返回的结果转换为float32数组，写入内存缓存和持久化缓存"""
+        fresh = {}
+        for t, r in zip(texts, results or []):
+            if r is None:
+                continue
+            r = np.asarray(r, dtype=np.float32)
+            self._set_cache(t, r)
+            cache_map[t] = r
+            fresh[t] = r
+        if fresh and self.persistent_cache is not None:
+            self.persistent_cache.put_many(self.name, self.fingerprint, fresh)
+
+    def _stack(self, texts: List[str], cache_map: dict) -> np.ndarray:
+        """将结果按texts顺序拼接为(n, dim)的float32数组"""
+        missing = [t for t in texts if cache_map.get(t) is None]
+        if missing:
+            raise RuntimeError(f"{len(missing)}条文本获取embedding失败")
+        if not texts:
+            return np.empty((0, len(self.test_embedding)), dtype=np.float32)
+        return np.stack([cache_map[t] for t in texts])
+
+    def _cleanup_cache(self):
+        self._embedding_cache.cleanup()
+
+
+
+    def _get_vectors(self, texts: List[str]) -> dict:
+        """获取去重后文本的向量，返回 文本->float32数组 映射，失败的文本不在其中"""
+        unique_texts = list(dict.fromkeys(texts))
+        cache_map, uncached_texts = self._lookup_cache(unique_texts)
         if uncached_texts:
-            results = self.providers[self.default_provider_index].get_embeddings(uncached_texts)
-            for t, r in zip(uncached_texts, results):
-                self._set_cache(t, r)
-                cache_map[t] = r
-        return [cache_map[t] for t in texts]
+            # 同步接口不等待退避，依次尝试组内其他provider
+            tried = set()
+            while True:
+                index = self.scheduler.pick(exclude=tried)
+                tried.add(index)
+                start = time.time()
+                try:
+                    results = self.providers[index].get_embeddings(uncached_texts, raise_errors=True)
+                except Exception as e:
+                    self.scheduler.record(index, time.time() - start, len(uncached_texts), False,
+                                          rate_limited=isinstance(e, RateLimitedError))
+                    if not self.scheduler.has_candidates(tried):
+                        raise
+                    continue
+                self.scheduler.record(index, time.time() - start, len(uncached_texts), True)
+                self._store_results(uncached_texts, results, cache_map)
+                break
+        return cache_map
+
+    def get_embedding(self, text: str):
+        return _to_list(self._get_vectors([text]).get(text))
+
+    def get_embeddings(self, texts: List[str]):
+        cache_map = self._get_vectors(texts)
+        return [_to_list(cache_map.get(t)) for t in texts]
+
+    def get_embedding_array(self, text: str) -> np.ndarray:
+        return self.get_embeddings_array([text])[0]
+
+    def get_embeddings_array(self, texts: List[str]) -> np.ndarray:
+        return self._stack(texts, self._get_vectors(texts))
 
     def get_dim(self):
         return self.providers[0].get_dim()
@@ -116,90 +241,442 @@ class ModelGroupProvider:
         return self.providers[self.default_provider_index].get_provider_name()
 
     def is_available(self):
-        return all(p.is_available() for p in self.providers)
+        """根据健康检查记录判断，不发送请求"""
+        return all(p.health.healthy for p in self.providers)
+
+    async def _get_vectors_async(self, texts: List[str], fuzzy: bool = True, raise_errors: bool = True) -> dict:
+        """
+        获取去重后文本的向量(异步版本)
+        正在被其他请求查询的文本不重复发起调用，而是等待其结果
+        :param fuzzy: 是否允许内存缓存的近似匹配，见_lookup_cache
+        :param raise_errors: 为False时记录日志后返回已成功的部分，失败的文本不在结果中
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        cache_map, uncached_texts = self._lookup_cache(unique_texts, fuzzy)
+        if not uncached_texts:
+            return cache_map
+
+        owned = [t for t in uncached_texts if t not in self._inflight]
+        if owned:
+            self._start_fetch(owned)
+        futures = {t: self._inflight[t].futures[t] for t in uncached_texts}
+        fetches = list({id(self._inflight[t]): self._inflight[t] for t in uncached_texts}.values())
+        for fetch in fetches:
+            fetch.waiters += 1
+        error = None
+        try:
+            for t, f in futures.items():
+                # shield避免当前调用被取消时连带取消共享的future
+                try:
+                    v = await asyncio.shield(f)
+                except asyncio.CancelledError:
+                    if not f.cancelled():
+                        raise
+                    # 其他调用方放弃的查询，不会发生在仍有等待者时
+                    v, error = None, error or RuntimeError("查询已取消")
+                except Exception as e:
+                    v, error = None, error or e
+                if v is not None:
+                    cache_map[t] = v
+        finally:
+            for fetch in fetches:
+                fetch.waiters -= 1
+                if fetch.waiters == 0 and not fetch.task.done():
+                    # 所有等待者都已取消，停止查询
+                    self._abandon_fetch(fetch)
+        if error is not None:
+            if raise_errors:
+                raise error
+            failed = sum(1 for t in uncached_texts if t not in cache_map)
+            logger.error(f"[{self.name}] {failed}条文本获取embedding失败: {type(error).__name__} {str(error)}")
+        return cache_map
+
+    def _start_fetch(self, texts: List[str]) -> _InflightFetch:
+        """
+        在独立的task中查询texts，每条文本对应一个共享的future
+        发起查询的调用方被取消时，只要还有其他调用方在等待，查询就继续进行
+        """
+        loop = asyncio.get_running_loop()
+        futures = {t: loop.create_future() for t in texts}
+        results = {}
+        fetch = _InflightFetch(loop.create_task(self._fetch_async(texts, results)), futures)
+        for t in texts:
+            self._inflight[t] = fetch
+
+        def finish(task: asyncio.Task):
+            error = None if task.cancelled() else task.exception()
+            for t, f in futures.items():
+                if self._inflight.get(t) is fetch:
+                    del self._inflight[t]
+                if f.done():
+                    continue
+                if t in results:
+                    # 部分批次失败时，已成功的文本仍返回结果
+                    f.set_result(results[t])
+                elif task.cancelled():
+                    f.cancel()
+                elif error is not None:
+                    f.set_exception(error)
+                    # 没有等待者时避免出现未读取异常的警告
+                    f.exception()
+                else:
+                    f.set_result(None)
+
+        fetch.task.add_done_callback(finish)
+        return fetch
+
+    def _abandon_fetch(self, fetch: _InflightFetch):
+        """取消没有等待者的查询，之后的调用方重新发起查询"""
+        for t in fetch.futures:
+            if self._inflight.get(t) is fetch:
+                del self._inflight[t]
+        fetch.task.cancel()
+
+    def _backoff(self, attempt: int) -> float:
+        """指数退避加随机抖动"""
+        delay = min(self.retry_backoff * (2 ** attempt), 5.0)
+        return delay * (0.5 + random.random() / 2)
+
+    async def _run_batch(self, batch: List[str], index: Optional[int] = None):
+        """
+        由调度器选择provider处理一个批次，失败时退避后转移到组内其他provider重试
+        被限流时不退避也不消耗重试次数，由限速器等待到Retry-After之后
+        index不为空时表示首次尝试使用已占用的该provider槽位
+        """
+        tried = set()
+        provider = None
+        reserved = index
+        attempt = 0
+        rate_limited = 0
+        while True:
+            # 组内其他provider都试过或已熔断时，允许重试之前失败的provider
+            if not self.scheduler.has_candidates(tried):
+                tried.clear()
+            try:
+                async with self.scheduler.slot(len(batch), exclude=tried, index=reserved) as index:
+                    # 预先占用的槽位只用于首次尝试，slot退出时即释放
+                    reserved = None
+                    provider = self.providers[index]
+                    tried.add(index)
+                    # 超时由provider在等待限速之后计算，避免本地排队被当作服务商超时
+                    return await provider.get_embeddings_async(batch, raise_errors=True, timeout=self.request_timeout)
+            except RateLimitedError:
+                rate_limited += 1
+                if rate_limited > self.rate_limit_retries:
+                    raise
+                continue
+            except NoAvailableProviderError:
+                if attempt >= self.try_count_limit:
+                    raise
+            except Exception as e:
+                name = provider.get_provider_name() if provider is not None else self.name
+                GROUP_ERRORS.inc(group=self.name, provider=name)
+                if isinstance(e, asyncio.TimeoutError):
+                    GROUP_TIMEOUTS.inc(group=self.name, provider=name)
+                if is_client_error(e):
+                    # 请求内容有误，换provider重试也不会成功，直接交给调用方
+                    logger.error(f"provider {name} 拒绝了{len(batch)}条文本的请求: {type(e).__name__} {str(e)}")
+                    raise
+                logger.error(f"provider {name} 处理{len(batch)}条文本失败({attempt + 1}/{self.try_count_limit + 1}): {type(e).__name__} {str(e)}")
+                if attempt >= self.try_count_limit:
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def _run_hedged(self, batch: List[str]):
+        """
+        先占用最优provider发送，超过该provider近期延迟的hedge_percentile分位数仍未返回时，
+        在预算允许的情况下向次优的空闲provider发送同一批次，采用先成功的结果并取消另一个
+        对冲请求只尝试一次，失败时仍以主请求（含重试）的结果为准
+        """
+        self.hedge_budget.deposit()
+        try:
+            index = await self.scheduler.acquire()
+        except NoAvailableProviderError:
+            return await self._run_batch(batch)
+        delay = self.scheduler.stats[index].latency_quantile(self.hedge_percentile, max_count=self.hedge_max_texts)
+        primary = asyncio.ensure_future(self._run_batch(batch, index=index))
+        tasks = {primary}
+        try:
+            if delay is None:
+                # 尚无足够的延迟样本，不进行对冲
+                return await primary
+            done, _ = await asyncio.wait(tasks, timeout=max(delay, self.hedge_min_delay))
+            if done:
+                return primary.result()
+            hedge_index = self._acquire_hedge_slot(index)
+            if hedge_index is None:
+                return await primary
+            hedge = asyncio.ensure_future(self._run_hedge(batch, hedge_index))
+            tasks.add(hedge)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        GROUP_HEDGES.inc(group=self.name, result="won" if task is hedge else "lost")
+                        return task.result()
+                    if task is primary:
+                        error = task.exception()
+                    else:
+                        GROUP_HEDGES.inc(group=self.name, result="failed")
+            raise error
+        finally:
+            # 取消较慢的一方，等待其释放provider槽位
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _acquire_hedge_slot(self, primary_index: int) -> Optional[int]:
+        """为对冲请求占用除主请求外的空闲provider，没有空闲provider或预算不足时返回None"""
+        try:
+            index = self.scheduler.try_acquire(exclude={primary_index})
+        except NoAvailableProviderError:
+            index = None
+        if index is None:
+            GROUP_HEDGES.inc(group=self.name, result="no_provider")
+            return None
+        if not self.hedge_budget.withdraw():
+            self.scheduler.cancel(index)
+            GROUP_HEDGES.inc(group=self.name, result="no_budget")
+            return None
+        return index
+
+    async def _run_hedge(self, batch: List[str], index: int):
+        provider = self.providers[index]
+        try:
+            async with self.scheduler.slot(len(batch), index=index):
+                return await provider.get_embeddings_async(batch, raise_errors=True, timeout=self.request_timeout)
+        except Exception as e:
+            logger.warning(f"provider {provider.get_provider_name()} 对冲请求失败: {type(e).__name__} {str(e)}")
+            raise
+
+    @staticmethod
+    def _take_batch(pending: deque, costs: Dict[str, int], provider: Provider) -> List[str]:
+        """从队列中取出不超过provider批量大小与token上限的文本，至少取一条"""
+        batch = [pending.popleft()]
+        tokens = costs[batch[0]]
+        while pending and len(batch) < provider.batch_size:
+            if provider.max_batch_tokens > 0 and tokens + costs[pending[0]] > provider.max_batch_tokens:
+                break
+            tokens += costs[pending[0]]
+            batch.append(pending.popleft())
+        return batch
+
+    async def _fetch_async(self, uncached_texts: List[str], cache_map: dict):
+        """
+        向provider请求未缓存的文本，结果写入cache_map
+        文本数量小于平衡阈值时整批发送，否则由多个worker先占用provider槽位，
+        再按该provider的批量大小与token上限从按长度排序的队列中取文本，成功的批次先写入缓存，再抛出失败批次的异常
+        """
+        if len(uncached_texts) < self.balance_threshold:
+            if self.hedge and len(uncached_texts) <= self.hedge_max_texts and len(self.providers) > 1:
+                result = await self._run_hedged(uncached_texts)
+            else:
+                result = await self._run_batch(uncached_texts)
+            self._store_results(uncached_texts, result, cache_map)
+            return
+        # 按估计token数从长到短排列，使每个批次内的文本长度相近
+        costs = {t: estimate_tokens(t) for t in uncached_texts}
+        pending = deque(sorted(uncached_texts, key=costs.__getitem__, reverse=True))
+        errors = []
+
+        async def worker():
+            while pending:
+                try:
+                    index = await self.scheduler.acquire()
+                except NoAvailableProviderError:
+                    # 全部熔断时交给_run_batch按重试策略等待
+                    index = None
+                if not pending:
+                    if index is not None:
+                        self.scheduler.cancel(index)
+                    return
+                if index is None:
+                    batch = list(pending)
+                    pending.clear()
+                else:
+                    batch = self._take_batch(pending, costs, self.providers[index])
+                try:
+                    result = await self._run_batch(batch, index=index)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                self._store_results(batch, result, cache_map)
+
+        workers = min(len(uncached_texts), len(self.providers) * self.scheduler.max_inflight)
+        await asyncio.gather(*[worker() for _ in range(workers)])
+        if errors:
+            raise errors[0]
+
+    async def _flush_micro_batch(self, texts: List[str]) -> dict:
+        """
+        提交合并后的单条请求，整批失败时逐条重新查询未取得结果的文本（同批中成功的文本已写入缓存）
+        :return: 文本 -> 向量或该文本的异常，一条文本被拒绝不会连累同批的其他调用方
+        """
+        results = await self._get_vectors_async(texts, raise_errors=False)
+        missing = [t for t in texts if t not in results]
+        if missing:
+            outcomes = await asyncio.gather(*[self._get_vectors_async([t]) for t in missing], return_exceptions=True)
+            for t, outcome in zip(missing, outcomes):
+                results[t] = outcome if isinstance(outcome, BaseException) else outcome.get(t)
+        return results
+
+    async def _get_vector_async(self, text: str, fuzzy: bool = True) -> Optional[np.ndarray]:
+        """获取单条文本的向量，启用合并时与其他并发请求一起提交"""
+        # 合并后的批次统一允许近似匹配，只做精确匹配时单独查询
+        if self._batcher is None or not fuzzy:
+            return (await self._get_vectors_async([text], fuzzy)).get(text)
+        # 未命中时合并后的批次会再查询一次缓存，由那次查询计入miss
+        cache_map, uncached_texts = self._lookup_cache([text], record_misses=False)
+        if not uncached_texts:
+            return cache_map[text]
+        return await self._batcher.submit(text)
 
     async def get_embedding_async(self, text: str):
-        self._cleanup_cache()
-        cached = self._get_from_cache(text)
-        if cached is not None:
-            return cached
-        result = await self.providers[self.default_provider_index].get_embedding_async(text)
-        self._set_cache(text, result)
-        return result
+        return _to_list(await self._get_vector_async(text))
 
     async def get_embeddings_async(self, texts: List[str]):
-        self._cleanup_cache()
-        unique_texts = list(dict.fromkeys(texts))
-        cache_map = {}
-        uncached_texts = []
-        for t in unique_texts:
-            cached = self._get_from_cache(t)
-            if cached is not None:
-                cache_map[t] = cached
-            else:
-                uncached_texts.append(t)
-        if uncached_texts:
-            if len(uncached_texts) < self.balance_threshold:
-                # 如果未缓存的文本数量小于平衡阈值，则使用第一个provider
-                results = await self.providers[self.default_provider_index].get_embeddings_async(uncached_texts)
-                for t, r in zip(uncached_texts, results):
-                    self._set_cache(t, r)
-                    cache_map[t] = r
+        cache_map = await self._get_vectors_async(texts)
+        return [_to_list(cache_map.get(t)) for t in texts]
+
+    async def get_embedding_array_async(self, text: str, fuzzy: bool = True) -> np.ndarray:
+        return self._stack([text], {text: await self._get_vector_async(text, fuzzy)})[0]
+
+    async def get_embeddings_array_async(self, texts: List[str], fuzzy: bool = True) -> np.ndarray:
+        return self._stack(texts, await self._get_vectors_async(texts, fuzzy))
+
+    def _chunk_tokens(self) -> int:
+        """默认分块大小：组内provider单条文本token上限的最小值，未设置时为512"""
+        limits = [p.max_input_tokens for p in self.providers if p.max_input_tokens > 0]
+        return min(limits) if limits else 512
+
+    async def get_document_embeddings_async(self, documents: List[str], chunk_tokens: Optional[int] = None,
+                                            overlap_tokens: Optional[int] = None, pooling: str = "mean"):
+        """
+        将长文档切分为相互重叠的块，所有文档的块在一次调度中统一请求，再按文档合并
+        :param chunk_tokens: 每块的最大token数，默认与模型的单条文本上限一致
+        :param overlap_tokens: 相邻块重叠的token数，默认为块大小的1/8
+        :param pooling: mean取各块平均，weighted按各块token数加权平均，结果归一化为单位向量；
+                        none不合并，返回[{"text": 块文本, "embedding": 向量}]
+        :return: 每个文档对应一项，存在失败的块时该文档为None
+        """
+        if pooling not in ("mean", "weighted", "none"):
+            raise ValueError(f"不支持的pooling方式: {pooling}")
+        chunk_tokens = chunk_tokens or self._chunk_tokens()
+        if overlap_tokens is None:
+            overlap_tokens = chunk_tokens // 8
+        chunks = [chunk_text(doc, chunk_tokens, overlap_tokens) for doc in documents]
+        # 各块之间字符集合相近，只使用精确匹配的缓存；部分块失败时只影响所属文档
+        cache_map = await self._get_vectors_async([c for doc_chunks in chunks for c in doc_chunks],
+                                                  fuzzy=False, raise_errors=False)
+        results = []
+        for doc_chunks in chunks:
+            vectors = [cache_map.get(c) for c in doc_chunks]
+            if any(v is None for v in vectors):
+                results.append(None)
+                continue
+            if pooling == "none":
+                results.append([{"text": c, "embedding": _to_list(v)} for c, v in zip(doc_chunks, vectors)])
+                continue
+            matrix = np.stack(vectors).astype(np.float64)
+            if pooling == "weighted":
+                weights = np.array([estimate_tokens(c) for c in doc_chunks], dtype=np.float64)
+                pooled = weights @ matrix / weights.sum()
             else:
-                # 分批分配任务给不同provider，动态调度，每个子任务的texts数目为self.batch_size
-                provider_count = len(self.providers)
-                provider_available = list(range(provider_count))  # 记录每个provider的占用情况
-                timeouts = 10  # 每个任务超时时间（秒）
-                provider_avg_time = [1.0] * provider_count # 初始化每个provider的平均响应时间
-
-                # 将uncached_texts分批，每批大小为self.batch_size
-                batches = [uncached_texts[i:i+self.batch_size] for i in range(0, len(uncached_texts), self.batch_size)]
-                batch_indices = [list(range(i, min(i+self.batch_size, len(uncached_texts)))) for i in range(0, len(uncached_texts), self.batch_size)]
-
-                logger.info(f"测试: {provider_available}")
-                async def run_batch(batch, indices):
-                    nonlocal provider_avg_time
-                    nonlocal provider_available
-                    try_count = 0
-                    while True:
-                        while not provider_available:
-                            # 如果所有provider都在忙，则等待
-                            await asyncio.sleep(0.1)
-                        if try_count > self.try_count_limit:
-                            raise RuntimeError("多次调用失败，终止查询")
-                        try_count += 1
-                        # 选择平均响应时间最短的provider
-                        provider_idx = min(provider_available, key=lambda i: provider_avg_time[i])
-                        provider_available.remove(provider_idx)  # 标记为占用
-                        # 选择provider_idx
-                        provider = self.providers[provider_idx]
-                        # logger.info(f"使用provider {provider.get_provider_name()}")
-                        start = time.time()
+                pooled = matrix.mean(axis=0)
+            norm = np.linalg.norm(pooled)
+            results.append((pooled / norm if norm else pooled).astype(np.float32).tolist())
+        return results
+
+    async def get_document_embedding_async(self, document: str, chunk_tokens: Optional[int] = None,
+                                           overlap_tokens: Optional[int] = None, pooling: str = "mean"):
+        return (await self.get_document_embeddings_async([document], chunk_tokens, overlap_tokens, pooling))[0]
+
+    async def aembed_stream(self, texts: Union[Iterable[str], AsyncIterable[str]], chunk_size: int = 256,
+                            max_pending: int = 4, ordered: bool = False
+                            ) -> AsyncIterator[Tuple[int, Optional[np.ndarray]]]:
+        """
+        流式获取embedding，按块读取输入，逐条产出(下标, float32向量)，失败的文本产出None
+        批量场景需要逐条准确的结果，内存缓存只做精确匹配
+        同时处理的块不超过max_pending个，调用方消费变慢时不再读取新的输入，内存占用与输入总量无关
+        :param ordered: 为True时按输入顺序产出，否则按块完成的顺序产出
+        """
+        if chunk_size <= 0 or max_pending <= 0:
+            raise ValueError("chunk_size与max_pending必须大于0")
+        if hasattr(texts, "__aiter__"):
+            source = texts.__aiter__()
+
+            async def next_text():
+                return await source.__anext__()
+        else:
+            source = iter(texts)
+
+            async def next_text():
+                try:
+                    return next(source)
+                except StopIteration:
+                    raise StopAsyncIteration
+
+        async def read_chunk() -> List[str]:
+            chunk = []
+            try:
+                while len(chunk) < chunk_size:
+                    chunk.append(await next_text())
+            except StopAsyncIteration:
+                pass
+            return chunk
+
+        # 正在处理的块: task -> (起始下标, 文本)
+        pending: Dict[asyncio.Task, Tuple[int, List[str]]] = {}
+        # ordered模式下已完成但还不能产出的块
+        finished: Dict[int, Tuple[List[str], dict]] = {}
+        next_start = 0
+        next_output = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) + len(finished) < max_pending:
+                    chunk = await read_chunk()
+                    if not chunk:
+                        exhausted = True
+                        break
+                    task = asyncio.ensure_future(self._get_vectors_async(chunk, fuzzy=False, raise_errors=False))
+                    pending[task] = (next_start, chunk)
+                    next_start += len(chunk)
+                    if len(chunk) < chunk_size:
+                        exhausted = True
+                if not pending and not finished:
+                    return
+                if pending:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        start, chunk = pending.pop(task)
                         try:
-                            r = await asyncio.wait_for(provider.get_embeddings_async(batch), timeout=timeouts)
-                            elapsed = time.time() - start
-                            # 更新平均响应时间（滑动平均）
-                            provider_avg_time[provider_idx] = 0.7 * provider_avg_time[provider_idx] + 0.3 * elapsed
-                            provider_available.append(provider_idx)  # 释放占用
-                            return r, indices
-                        except Exception:
-                            provider_avg_time[provider_idx] += 2  # 出错惩罚
-                            provider_available.append(provider_idx)
-                            logger.error(f"provider {provider.get_provider_name()} 处理文本失败: {batch}")
-                            raise
-
-                tasks = [asyncio.create_task(run_batch(batch, idxs)) for batch, idxs in zip(batches, batch_indices)]
-                finished = await asyncio.gather(*tasks)
-                for r, idxs in finished:
-                    for i, t_idx in enumerate(idxs):
-                        t = uncached_texts[t_idx]
-                        self._set_cache(t, r[i])
-                        cache_map[t] = r[i]
-        return [cache_map[t] for t in texts]
+                            cache_map = task.result()
+                        except Exception as e:
+                            # 单个块失败时该块的文本产出None，不中断整个流
+                            logger.error(f"[{self.name}] 第{start}~{start + len(chunk) - 1}条文本获取embedding失败: "
+                                         f"{type(e).__name__} {str(e)}")
+                            cache_map = {}
+                        finished[start] = (chunk, cache_map)
+                while finished:
+                    start = next_output if ordered else next(iter(finished))
+                    if start not in finished:
+                        break
+                    chunk, cache_map = finished.pop(start)
+                    next_output = start + len(chunk)
+                    for i, text in enumerate(chunk):
+                        yield start + i, cache_map.get(text)
+        finally:
+            for task in pending:
+                task.cancel()
+            # 等待取消完成，流关闭后不再占用_inflight中的文本
+            await asyncio.gather(*pending, return_exceptions=True)
 
     async def get_dim_async(self):
         return await self.providers[0].get_dim_async()
 
     async def is_available_async(self):
-        results = await asyncio.gather(*[p.is_available_async() for p in self.providers])
-        return all(results)
+        return self.is_available()
@@ -0,0 +1,116 @@
+"""
+probe.py
+启动时并发探测服务商可用性，并缓存探测结果
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from astrbot.api import logger
+
+from .embedding_providers import Provider
+from .utils import write_json_atomic
+
+
+class ProbeCache:
+    """
+    以provider配置的哈希为键保存探测得到的维数与测试向量，重启时在有效期内直接复用
+    只缓存成功的结果，失败的provider每次启动都会重新探测
+    """
+    def __init__(self, path: str, ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: Dict[str, dict] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取探测缓存失败: {str(e)}")
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._data.get(key)
+        if entry is None or time.time() - entry.get("time", 0) > self.ttl:
+            return None
+        return entry
+
+    def set(self, key: str, test_embedding: list):
+        with self._lock:
+            self._data[key] = {"dim": len(test_embedding), "test_embedding": test_embedding, "time": time.time()}
+
+    def remove(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def save(self):
+        with self._lock:
+            try:
+                write_json_atomic(self.path, self._data)
+            except OSError as e:
+                logger.error(f"保存探测缓存失败: {str(e)}")
+
+
+def _probe(provider: Provider) -> bool:
+    try:
+        return provider.is_available()
+    except Exception as e:
+        logger.error(f"服务商 {provider.get_provider_name()} 探测失败: {str(e)}")
+        return False
+
+
+def probe_providers(providers: List[Provider], cache: Optional[ProbeCache] = None, deadline: float = 15.0,
+                    on_late: Optional[Callable[[Provider, bool], None]] = None) -> Dict[str, bool]:
+    """
+    并发探测provider的可用性，命中缓存的provider不发送请求
+    :param deadline: 最多等待的秒数，超时的provider视为暂不可用，完成后通过on_late回调通知
+    :return: provider名称 -> 是否可用
+    """
+    results = {}
+    to_probe = []
+    for provider in providers:
+        cached = cache.get(provider.config_hash()) if cache is not None else None
+        if cached is not None:
+            provider.set_probe_result(cached["test_embedding"])
+            results[provider.name] = True
+        else:
+            to_probe.append(provider)
+    if not to_probe:
+        return results
+
+    def finish(provider: Provider, ok: bool):
+        if cache is None:
+            return
+        if ok:
+            cache.set(provider.config_hash(), provider.test_embedding)
+        else:
+            cache.remove(provider.config_hash())
+
+    executor = ThreadPoolExecutor(max_workers=min(16, len(to_probe)), thread_name_prefix="embedding_probe")
+    futures = {executor.submit(_probe, provider): provider for provider in to_probe}
+    done, not_done = wait(futures, timeout=deadline)
+    for future in done:
+        provider = futures[future]
+        results[provider.name] = future.result()
+        finish(provider, results[provider.name])
+    for future in not_done:
+        provider = futures[future]
+        results[provider.name] = False
+        logger.warning(f"服务商 {provider.get_provider_name()} 探测超过{deadline}秒，稍后完成时再加入模型组")
+
+        def late(f, provider=provider):
+            ok = f.result()
+            finish(provider, ok)
+            if cache is not None:
+                cache.save()
+            if on_late is not None:
+                on_late(provider, ok)
+        future.add_done_callback(late)
+    # 不等待超时的探测线程结束
+    executor.shutdown(wait=False)
+    if cache is not None:
+        cache.save()
+    return results
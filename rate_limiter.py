@@ -0,0 +1,165 @@
+"""
+rate_limiter.py
+服务商请求速率限制
+"""
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class RateLimitedError(RuntimeError):
+    """服务商返回429，retry_after为建议的等待秒数"""
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """解析Retry-After头，支持秒数与HTTP日期两种格式"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def status_code_of(e: Exception) -> Optional[int]:
+    """从httpx/requests/openai/genai等库的异常中取出HTTP状态码"""
+    response = getattr(e, "response", None)
+    status = getattr(response, "status_code", None) or getattr(e, "status_code", None) or getattr(e, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_client_error(e: Exception) -> bool:
+    """
+    是否为请求内容本身有误的4xx错误，换provider重试也不会成功，不应计入服务商故障
+    408超时、429限流以及401/403/404（密钥、权限、模型名等该服务商的配置问题）不属于此类
+    """
+    status = status_code_of(e)
+    return status is not None and 400 <= status < 500 and status not in (401, 403, 404, 408, 429)
+
+
+def rate_limit_info(e: Exception) -> Optional[float]:
+    """
+    判断异常是否为429限流
+    :return: 非限流错误返回None，否则返回Retry-After秒数（未提供时为0）
+    """
+    if isinstance(e, RateLimitedError):
+        return e.retry_after or 0.0
+    if status_code_of(e) != 429:
+        return None
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    return parse_retry_after(headers.get("retry-after")) or 0.0
+
+
+class TokenBucket:
+    """
+    预约式令牌桶：先扣除令牌，余额为负时返回需要等待的时间
+    速率会在限流时乘性下降，成功后加性恢复到配置值
+    """
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0, min_factor: float = 0.1):
+        self.per_minute = per_minute
+        self.burst_seconds = burst_seconds
+        self.min_factor = min_factor
+        self.factor = 1.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        """当前每秒速率"""
+        return self.per_minute * self.factor / 60
+
+    @property
+    def capacity(self) -> float:
+        return max(1.0, self.rate * self.burst_seconds)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """不扣除令牌，仅计算取得cost个令牌需要等待的时间"""
+        self._refill()
+        return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+    def reserve(self, cost: float = 1.0) -> float:
+        """扣除cost个令牌，返回需要等待的时间"""
+        self._refill()
+        self.tokens -= cost
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, cost: float = 1.0):
+        """归还预约后未使用的令牌"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def decrease(self):
+        self.factor = max(self.min_factor, self.factor * 0.5)
+        self.tokens = min(self.tokens, 0.0)
+
+    def increase(self):
+        self.factor = min(1.0, self.factor + 0.05)
+
+
+class RateLimiter:
+    """
+    单个服务商（单个key）的请求数/token数限制，rpm或tpm为0表示不限制
+    收到429时按Retry-After暂停，并降低速率
+    """
+    def __init__(self, rpm: float = 0, tpm: float = 0, default_retry_after: float = 1.0):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.default_retry_after = default_retry_after
+        self.blocked_until = 0.0
+        self.rate_limited = 0
+
+    def _buckets(self, tokens: float):
+        if self.requests is not None:
+            yield self.requests, 1.0
+        if self.tokens is not None:
+            yield self.tokens, tokens
+
+    def delay(self, tokens: float = 0) -> float:
+        """发送一次请求前预计需要等待的时间"""
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        for bucket, cost in self._buckets(tokens):
+            wait = max(wait, bucket.wait_time(cost))
+        return wait
+
+    def reserve(self, tokens: float = 0) -> float:
+        """预约一次请求，返回发送前需要等待的时间"""
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        for bucket, cost in self._buckets(tokens):
+            wait = max(wait, bucket.reserve(cost))
+        return wait
+
+    def refund(self, tokens: float = 0):
+        """请求在发出前被取消时归还预约"""
+        for bucket, cost in self._buckets(tokens):
+            bucket.refund(cost)
+
+    @property
+    def max_request_tokens(self) -> int:
+        """单个请求最多使用的token数，即tpm令牌桶在正常速率下的容量，0表示不限制"""
+        if self.tokens is None:
+            return 0
+        return max(1, int(self.tokens.per_minute * self.tokens.burst_seconds / 60))
+
+    def on_success(self):
+        for bucket, _ in self._buckets(0):
+            bucket.increase()
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        self.rate_limited += 1
+        if not retry_after:
+            retry_after = self.default_retry_after
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        for bucket, _ in self._buckets(0):
+            bucket.decrease()
@@ -0,0 +1,287 @@
+"""
+scheduler.py
+模型组内provider的负载均衡调度
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from .rate_limiter import RateLimiter, RateLimitedError, is_client_error
+from .health import ProviderHealth
+from .metrics import SCHEDULER_WAIT
+
+
+class NoAvailableProviderError(RuntimeError):
+    """模型组内所有provider均处于熔断状态"""
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败failure_threshold次后断开，reset_timeout秒后进入半开状态，
+    放行一个探测请求，成功则恢复，失败则再次断开
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """当前是否可以向该provider发送请求"""
+        if self.state == self.OPEN and time.time() >= self.open_until:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.CLOSED:
+            return True
+        return self.state == self.HALF_OPEN and not self._probing
+
+    def on_start(self):
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def on_start_cancelled(self):
+        """探测请求未得出结论（如被限流），允许再次探测"""
+        self._probing = False
+
+    def on_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def on_failure(self):
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.open_until = time.time() + self.reset_timeout
+
+
+class ProviderStats:
+    """单个provider的运行统计，跨请求保留"""
+    def __init__(self, alpha: float = 0.3, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[RateLimiter] = None, health: Optional[ProviderHealth] = None):
+        self.alpha = alpha
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter
+        self.health = health
+        self.inflight = 0
+        # 单次请求耗时与每秒处理文本数的指数滑动平均，None表示尚无样本
+        self.latency: Optional[float] = None
+        self.throughput: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        # 最近成功请求的(文本数, 耗时)，用于估计延迟分位数
+        self.samples = deque(maxlen=100)
+
+    def record(self, elapsed: float, count: int, ok: bool):
+        self.requests += 1
+        if not ok:
+            self.failures += 1
+            return
+        self.samples.append((count, elapsed))
+        rate = count / elapsed if elapsed > 0 else float(count)
+        if self.latency is None:
+            self.latency, self.throughput = elapsed, rate
+        else:
+            self.latency = (1 - self.alpha) * self.latency + self.alpha * elapsed
+            self.throughput = (1 - self.alpha) * self.throughput + self.alpha * rate
+
+    def latency_quantile(self, q: float, max_count: int = 0, min_samples: int = 10) -> Optional[float]:
+        """
+        最近成功请求耗时的q分位数，样本不足时返回None
+        :param max_count: 大于0时只统计文本数不超过该值的请求，避免大批量请求拉高估计
+        """
+        ordered = sorted(e for c, e in self.samples if max_count <= 0 or c <= max_count)
+        if len(ordered) < min_samples:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgeBudget:
+    """
+    对冲请求预算：每个可对冲的请求积累ratio个令牌，每次发出对冲请求消耗一个，最多积累burst个
+    长期来看对冲请求数不超过可对冲请求数的ratio倍
+    """
+    def __init__(self, ratio: float = 0.1, burst: float = 10.0):
+        self.ratio = max(0.0, ratio)
+        self.burst = max(1.0, burst)
+        self.tokens = 0.0
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ProviderScheduler:
+    """
+    长期存在的调度器，由ModelGroupProvider持有
+    按 滑动平均耗时*(在途请求数+1) 选择预计最快完成的provider，
+    每个provider最多同时处理max_inflight个批次，没有空闲provider时挂起等待槽位释放而不是轮询
+    """
+    def __init__(self, provider_count: int, name: str = "", default_index: int = 0, max_inflight: int = 2,
+                 failure_penalty: float = 2.0, breaker_threshold: int = 3, breaker_timeout: float = 30.0,
+                 limiters: Optional[List[RateLimiter]] = None, healths: Optional[List[ProviderHealth]] = None):
+        self.name = name
+        self.default_index = default_index
+        self.max_inflight = max(1, max_inflight)
+        self.failure_penalty = failure_penalty
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        limiters = limiters or [None] * provider_count
+        healths = healths or [None] * provider_count
+        self.stats: List[ProviderStats] = [self._new_stats(limiters[i], healths[i]) for i in range(provider_count)]
+        # 等待空闲槽位的future，槽位释放时唤醒
+        self._waiters: List[asyncio.Future] = []
+
+    def _new_stats(self, limiter: Optional[RateLimiter] = None, health: Optional[ProviderHealth] = None) -> ProviderStats:
+        return ProviderStats(breaker=CircuitBreaker(self.breaker_threshold, self.breaker_timeout),
+                             limiter=limiter, health=health)
+
+    def add_provider(self, limiter: Optional[RateLimiter] = None, health: Optional[ProviderHealth] = None):
+        self.stats.append(self._new_stats(limiter, health))
+
+    def _score(self, index: int) -> tuple:
+        stats = self.stats[index]
+        latency = stats.latency if stats.latency is not None else 1.0
+        # 受限流的provider加上需要等待的时间
+        wait = stats.limiter.delay() if stats.limiter is not None else 0.0
+        # 分数相同时优先选择默认provider
+        return latency * (stats.inflight + 1) + wait, index != self.default_index
+
+    def _candidates(self, exclude=()) -> List[int]:
+        """未被排除且熔断器允许请求的provider，健康检查不通过的provider仅在没有其他选择时使用"""
+        allowed = [i for i in range(len(self.stats)) if i not in exclude and self.stats[i].breaker.allow()]
+        healthy = [i for i in allowed if self.stats[i].health is None or self.stats[i].health.healthy]
+        return healthy or allowed
+
+    def has_candidates(self, exclude=()) -> bool:
+        return bool(self._candidates(exclude))
+
+    def pick(self, exclude=()) -> int:
+        """同步选择当前最优的provider，不等待空闲槽位"""
+        candidates = self._candidates(exclude)
+        if not candidates:
+            raise NoAvailableProviderError("所有provider均不可用")
+        index = min(candidates, key=self._score)
+        self.stats[index].breaker.on_start()
+        return index
+
+    def record(self, index: int, elapsed: float, count: int, ok: bool, rate_limited: bool = False,
+               client_error: bool = False):
+        stats = self.stats[index]
+        if client_error:
+            # 请求内容有误，服务商本身正常，不计入失败统计与熔断
+            stats.breaker.on_start_cancelled()
+            return
+        stats.record(elapsed, count, ok)
+        if ok:
+            stats.breaker.on_success()
+        elif rate_limited:
+            # 限流由限速器处理，不计入熔断，也不污染耗时统计
+            stats.breaker.on_start_cancelled()
+        else:
+            stats.latency = (stats.latency or 1.0) + self.failure_penalty  # 出错惩罚
+            stats.breaker.on_failure()
+
+    def try_acquire(self, exclude=()) -> Optional[int]:
+        """立即占用一个空闲的provider槽位，没有空闲槽位时返回None"""
+        candidates = self._candidates(exclude)
+        if not candidates:
+            raise NoAvailableProviderError("所有provider均不可用")
+        free = [i for i in candidates if self.stats[i].inflight < self.max_inflight]
+        if not free:
+            return None
+        index = min(free, key=self._score)
+        self.stats[index].inflight += 1
+        self.stats[index].breaker.on_start()
+        return index
+
+    async def acquire(self, exclude=()) -> int:
+        """等待并占用一个空闲的provider槽位，返回provider索引"""
+        start = time.time()
+        while True:
+            index = self.try_acquire(exclude)
+            if index is not None:
+                SCHEDULER_WAIT.observe(time.time() - start, group=self.name)
+                return index
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def release(self, index: int, elapsed: float, count: int, ok: bool, rate_limited: bool = False,
+                client_error: bool = False):
+        self.stats[index].inflight -= 1
+        self.record(index, elapsed, count, ok, rate_limited, client_error)
+        # 唤醒所有等待者重新选择，被排除的等待者会继续等待
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def cancel(self, index: int):
+        """归还通过acquire占用但未使用的槽位，不计入统计"""
+        self.stats[index].inflight -= 1
+        self.stats[index].breaker.on_start_cancelled()
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, count: int, exclude=(), index: Optional[int] = None):
+        """
+        占用一个provider槽位执行一批请求，退出时自动记录耗时并释放
+        index不为空时表示已通过acquire占用该槽位
+        使用者在失败时应抛出异常，以便计入失败统计，被取消（如对冲请求中较慢的一方）时不计入统计
+        """
+        if index is None:
+            index = await self.acquire(exclude)
+        start = time.time()
+        try:
+            yield index
+        except RateLimitedError:
+            self.release(index, time.time() - start, count, False, rate_limited=True)
+            raise
+        except asyncio.CancelledError:
+            self.cancel(index)
+            raise
+        except Exception as e:
+            self.release(index, time.time() - start, count, False, client_error=is_client_error(e))
+            raise
+        except BaseException:
+            self.release(index, time.time() - start, count, False)
+            raise
+        else:
+            self.release(index, time.time() - start, count, True)
+
+    def summary(self) -> List[dict]:
+        return [
+            {
+                "inflight": s.inflight,
+                "latency": s.latency,
+                "throughput": s.throughput,
+                "requests": s.requests,
+                "failures": s.failures,
+                "breaker": s.breaker.state,
+                "rate_limited": s.limiter.rate_limited if s.limiter is not None else 0,
+                "healthy": s.health.healthy if s.health is not None else True,
+            }
+            for s in self.stats
+        ]
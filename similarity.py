@@ -0,0 +1,92 @@
+"""
+similarity.py
+基于numpy的批量向量相似度计算与top-k检索
+"""
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+
+VectorLike = Union[np.ndarray, Sequence[float]]
+MatrixLike = Union[np.ndarray, Sequence[Sequence[float]]]
+
+
+def as_matrix(vectors: MatrixLike) -> np.ndarray:
+    """
+    转换为(n, dim)的float32矩阵，已是float32数组时不复制
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.ndim != 2:
+        raise ValueError(f"向量矩阵必须为二维，当前为{matrix.ndim}维")
+    return matrix
+
+
+def normalize(vectors: MatrixLike) -> np.ndarray:
+    """
+    按行归一化为单位向量，零向量保持为零
+    预先归一化后存储，检索时可直接用点积代替余弦相似度
+    """
+    matrix = as_matrix(vectors)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def dot_similarity(query: MatrixLike, matrix: MatrixLike) -> np.ndarray:
+    """
+    计算点积
+    :return: query为一维时返回(n,)，为(q, dim)时返回(q, n)
+    """
+    q = as_matrix(query)
+    m = as_matrix(matrix)
+    if q.shape[1] != m.shape[1]:
+        raise ValueError(f"向量维数不一致: {q.shape[1]} != {m.shape[1]}")
+    scores = q @ m.T
+    return scores[0] if np.ndim(query) == 1 else scores
+
+
+def cosine_similarity(query: MatrixLike, matrix: MatrixLike, normalized: bool = False) -> np.ndarray:
+    """
+    计算余弦相似度
+    :param normalized: matrix已通过normalize归一化时跳过对matrix的归一化
+    :return: query为一维时返回(n,)，为(q, dim)时返回(q, n)
+    """
+    q = normalize(query)
+    m = as_matrix(matrix) if normalized else normalize(matrix)
+    if q.shape[1] != m.shape[1]:
+        raise ValueError(f"向量维数不一致: {q.shape[1]} != {m.shape[1]}")
+    scores = q @ m.T
+    return scores[0] if np.ndim(query) == 1 else scores
+
+
+def top_k(query: VectorLike, matrix: MatrixLike, k: int, normalized: bool = False,
+          metric: str = "cosine") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    返回与query最相似的k个向量
+    :param metric: "cosine"或"dot"
+    :return: (下标, 相似度)，按相似度从高到低排列
+    """
+    if metric == "cosine":
+        scores = cosine_similarity(query, matrix, normalized=normalized)
+    elif metric == "dot":
+        scores = dot_similarity(query, matrix)
+    else:
+        raise ValueError(f"不支持的相似度类型: {metric}")
+    if scores.ndim != 1:
+        raise ValueError("top_k的query必须为单个向量")
+    return top_k_scores(scores, k)
+
+
+def top_k_scores(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """从相似度数组中选出最大的k个，使用argpartition避免全量排序"""
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    if k < n:
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(n)
+    indices = indices[np.argsort(-scores[indices], kind="stable")]
+    return indices, scores[indices]
@@ -0,0 +1,27 @@
+"""
+tests/_common.py
+测试公共工具，在AstrBot根目录下运行，以便导入astrbot与插件模块
+运行: python -m pytest data/plugins/<插件目录>/tests
+"""
+import importlib
+import os
+import sys
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_PACKAGE = os.path.basename(PLUGIN_DIR)
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+
+
+def load(module: str):
+    """按插件包名导入插件内的模块，如 load("batch_sizer")"""
+    return importlib.import_module(f"{PLUGIN_PACKAGE}.{module}")
+
+
+def http_error(status: int, text: str = "error"):
+    """构造服务商返回status时httpx抛出的异常"""
+    import httpx
+    request = httpx.Request("POST", "http://127.0.0.1/v1/embeddings")
+    response = httpx.Response(status, request=request, text=text)
+    return httpx.HTTPStatusError(f"{status} error", request=request, response=response)
@@ -0,0 +1,91 @@
+"""
+tests/test_batch_sizer.py
+自适应批量：只有确认是批量过大时才降低并记录上限
+"""
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from _common import http_error, load
+
+batch_sizer = load("batch_sizer")
+embedding_providers = load("embedding_providers")
+
+
+class FakeProvider(embedding_providers.Provider):
+    """max_batch以上的批量返回too many inputs，包含bad文本的请求返回bad_status"""
+    def __init__(self, max_batch: int = 0, bad_status: int = 400):
+        super().__init__("fake", {"embed_model": "fake-model", "batch_size": "auto"})
+        self.max_batch = max_batch
+        self.bad_status = bad_status
+        self.sizes = []
+
+    def _respond(self, texts):
+        self.sizes.append(len(texts))
+        if self.max_batch and len(texts) > self.max_batch:
+            raise http_error(400, f"Too many inputs: at most {self.max_batch} inputs per request")
+        if "bad" in texts:
+            raise http_error(self.bad_status, "invalid input")
+        return [[random.Random(t).random() for _ in range(4)] for t in texts]
+
+    def _get_embeddings(self, texts):
+        return self._respond(texts)
+
+    async def _get_embeddings_async(self, texts):
+        return self._respond(texts)
+
+
+def test_item_failure_sequence_keeps_batch_size():
+    sizer = batch_sizer.BatchSizer(initial=16)
+    # 同一条文本导致的错误在拆分到单条时仍然出现
+    for size in (16, 8, 4, 2, 1):
+        sizer.on_rejected(size)
+    assert sizer.current == 1
+    for size in (2, 4, 8, 16):
+        sizer.on_split_failed(size)
+    assert sizer.current == 16
+    assert sizer.ceiling is None
+    assert sizer.state()["ceiling"] is None
+
+
+def test_confirmed_rejection_sets_ceiling():
+    sizer = batch_sizer.BatchSizer(initial=16)
+    sizer.on_rejected(16)
+    sizer.on_split_succeeded(16)
+    assert sizer.current == 8
+    assert sizer.ceiling == 15
+    sizer.on_rejected(1)
+    assert sizer.current == 8
+
+
+@pytest.mark.parametrize("status", [400, 422])
+def test_invalid_item_is_not_a_batch_rejection(status):
+    provider = FakeProvider(bad_status=status)
+    texts = [f"text {i}" for i in range(12)] + ["bad"]
+    with pytest.raises(httpx.HTTPStatusError):
+        provider.get_embeddings(texts, raise_errors=True)
+    # 没有拆分重试，批量参数不变
+    assert provider.sizes == [13]
+    assert provider.batch_sizer.current == 16
+    assert provider.batch_sizer.ceiling is None
+
+
+def test_item_413_does_not_lower_ceiling():
+    provider = FakeProvider(bad_status=413)
+    texts = [f"text {i}" for i in range(15)] + ["bad"]
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(provider.get_embeddings_async(texts, raise_errors=True))
+    assert min(provider.sizes) == 1
+    assert provider.batch_sizer.current == 16
+    assert provider.batch_sizer.state()["ceiling"] is None
+
+
+def test_too_many_inputs_learns_ceiling():
+    provider = FakeProvider(max_batch=4)
+    texts = [f"text {i}" for i in range(16)]
+    vectors = asyncio.run(provider.get_embeddings_async(texts, raise_errors=True))
+    assert all(v is not None for v in vectors)
+    assert provider.batch_sizer.ceiling == 7
+    assert provider.batch_sizer.current <= 7
@@ -0,0 +1,65 @@
+"""
+tests/test_bulk_job.py
+批量向量化任务：服务商故障期间失败的行在再次运行时重试
+"""
+import asyncio
+import random
+
+import numpy as np
+
+from _common import http_error, load
+
+embedding_providers = load("embedding_providers")
+model_group = load("model_group")
+bulk_job = load("bulk_job")
+
+
+class FlakyProvider(embedding_providers.Provider):
+    """处理limit条文本后开始返回503"""
+    def __init__(self, limit: int = -1):
+        super().__init__("flaky", {"embed_model": "fake-model", "batch_size": "16"})
+        self.limit = limit
+        self.texts = 0
+
+    @staticmethod
+    def vector(text: str):
+        return [random.Random(text).random() for _ in range(4)]
+
+    def _get_embeddings(self, texts):
+        return [self.vector(t) for t in texts]
+
+    async def _get_embeddings_async(self, texts):
+        if 0 <= self.limit <= self.texts:
+            raise http_error(503, "service unavailable")
+        self.texts += len(texts)
+        return [self.vector(t) for t in texts]
+
+
+def test_outage_rows_are_retried_on_resume(tmp_path):
+    corpus = tmp_path / "corpus.txt"
+    texts = [f"line {i}" for i in range(300)]
+    corpus.write_text("\n".join(texts) + "\n", encoding="utf-8")
+    provider = FlakyProvider()
+    config = {"scheduler": {"max_retries": 0, "retry_backoff": 0.0}}
+    group = model_group.ModelGroupProvider("group", [provider], config=config)
+    provider.limit = 100
+    output = str(tmp_path / "out")
+
+    job = bulk_job.EmbeddingJob(group, str(corpus), output, chunk_size=32)
+    progress = asyncio.run(job.run())
+    assert progress["rows"] == len(texts)
+    assert progress["failed"] > 0
+    assert not progress["done"]
+
+    # 服务恢复后再次运行，只重试失败的行；新建模型组避免等待熔断恢复
+    provider.limit = -1
+    provider.texts = 0
+    group = model_group.ModelGroupProvider("group", [provider], config=config)
+    job = bulk_job.EmbeddingJob(group, str(corpus), output, chunk_size=32)
+    progress = asyncio.run(job.run())
+    assert progress["done"]
+    assert progress["failed"] == 0
+    assert provider.texts < len(texts)
+    vectors = job.load_vectors()
+    expected = np.array([provider.vector(t) for t in texts], dtype=np.float32)
+    assert np.allclose(vectors, expected)
@@ -0,0 +1,55 @@
+"""
+tests/test_concurrency.py
+OpenAI与Gemini服务商的异步路径会同时发出多个批次，使用benchmarks中的本地模拟服务统计服务端同时处理的请求数
+"""
+import asyncio
+
+import pytest
+
+from _common import load
+
+embedding_providers = load("embedding_providers")
+mock_servers = load("benchmarks.mock_servers")
+
+MAX_CONCURRENCY = 4
+
+
+@pytest.fixture(scope="module")
+def servers():
+    specs = [
+        {"kind": "openai", "latency": 0.2, "jitter": 0.0, "dim": 16},
+        {"kind": "gemini", "latency": 0.2, "jitter": 0.0, "dim": 16},
+    ]
+    with mock_servers.MockServerProcess(specs) as process:
+        yield process
+
+
+def make_provider(kind: str, url: str):
+    config = {"embed_model": "mock-model", "api_url": url, "api_key": "mock",
+              "batch_size": "4", "max_concurrency": MAX_CONCURRENCY}
+    if kind == "openai":
+        pytest.importorskip("openai")
+        return embedding_providers.OpenaiProvider("mock_openai", config)
+    pytest.importorskip("google.genai")
+    return embedding_providers.GeminiProvider("mock_gemini", config)
+
+
+@pytest.mark.parametrize("index, kind", [(0, "openai"), (1, "gemini")])
+def test_batches_in_flight_concurrently(servers, index, kind):
+    provider = make_provider(kind, servers.urls[index])
+    texts = [f"{kind} text {i}" for i in range(32)]
+
+    async def run():
+        try:
+            return await provider.get_embeddings_async(texts, raise_errors=True)
+        finally:
+            await provider.close_async()
+
+    vectors = asyncio.run(run())
+    assert len(vectors) == len(texts)
+    assert all(v is not None and len(v) == 16 for v in vectors)
+    stats = servers.stats()[index]
+    # 32条文本按每批4条分为8个批次
+    assert stats["requests"] == 8
+    assert 1 < stats["max_inflight"] <= MAX_CONCURRENCY
+    assert stats["inflight"] == 0
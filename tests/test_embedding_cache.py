@@ -0,0 +1,42 @@
+"""
+tests/test_embedding_cache.py
+持久化缓存命中时的访问时间批量写回
+"""
+import sqlite3
+
+import numpy as np
+
+from _common import load
+
+embedding_cache = load("embedding_cache")
+
+
+def last_access(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT last_access FROM embedding_cache").fetchone()[0]
+
+
+def test_hits_do_not_write_until_flush(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = embedding_cache.PersistentEmbeddingCache(path, flush_interval=3600)
+    cache.put("group", "fp", "text", np.ones(4, dtype=np.float32))
+    written = last_access(path)
+
+    changes = cache._conn.total_changes
+    for _ in range(10):
+        assert cache.get("group", "fp", "text") is not None
+    assert cache._conn.total_changes == changes
+    assert last_access(path) == written
+
+    cache.close()
+    assert last_access(path) > written
+
+
+def test_flush_size_bounds_pending_updates(tmp_path):
+    cache = embedding_cache.PersistentEmbeddingCache(str(tmp_path / "cache.db"), flush_interval=3600, flush_size=3)
+    cache.put_many("group", "fp", {f"t{i}": np.ones(4, dtype=np.float32) for i in range(5)})
+    cache.get_many("group", "fp", ["t0", "t1"])
+    assert len(cache._accessed) == 2
+    cache.get_many("group", "fp", ["t2"])
+    assert not cache._accessed
+    cache.close()
@@ -0,0 +1,23 @@
+"""
+tests/test_embedding_providers.py
+超长文本分段后的结果合并
+"""
+import numpy as np
+
+from _common import load
+
+embedding_providers = load("embedding_providers")
+
+
+def test_split_pieces_merge_to_unit_vector():
+    pieces = ["first piece of text", "second", "short"]
+    results = [[1.0, 0.0], [0.0, 1.0], [1.0, 0.0]]
+    merged = embedding_providers.Provider._merge(2, pieces, [0, 0, 1], results)
+    assert np.isclose(np.linalg.norm(merged[0]), 1.0)
+    assert merged[0][0] > merged[0][1] > 0
+    assert merged[1] == [1.0, 0.0]
+
+
+def test_failed_piece_fails_its_text():
+    merged = embedding_providers.Provider._merge(2, ["a", "b", "c"], [0, 0, 1], [[1.0, 0.0], None, [0.0, 1.0]])
+    assert merged == [None, [0.0, 1.0]]
@@ -0,0 +1,138 @@
+"""
+tests/test_model_group.py
+模型组的并发查询合并
+"""
+import asyncio
+import random
+
+import numpy as np
+
+from _common import http_error, load
+
+embedding_providers = load("embedding_providers")
+model_group = load("model_group")
+
+
+class FakeProvider(embedding_providers.Provider):
+    """每个请求耗时delay秒"""
+    def __init__(self, name: str = "fake", delay: float = 0.0):
+        super().__init__(name, {"embed_model": "fake-model", "batch_size": "8"})
+        self.delay = delay
+        self.requests = []
+
+    @staticmethod
+    def vector(text: str):
+        return [random.Random(text).random() for _ in range(4)]
+
+    def _get_embeddings(self, texts):
+        return [self.vector(t) for t in texts]
+
+    async def _get_embeddings_async(self, texts):
+        self.requests.append(list(texts))
+        await asyncio.sleep(self.delay)
+        return [self.vector(t) for t in texts]
+
+
+def make_group(*providers, **scheduler_config):
+    config = {"scheduler": dict({"retry_backoff": 0.0}, **scheduler_config)}
+    return model_group.ModelGroupProvider("group", list(providers), config=config)
+
+
+def test_owner_cancellation_does_not_fail_other_waiters():
+    provider = FakeProvider(delay=0.2)
+    group = make_group(provider)
+
+    async def run():
+        owner = asyncio.ensure_future(asyncio.wait_for(group.get_embedding_async("x"), 0.05))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(group.get_embedding_async("x"))
+        try:
+            await owner
+        except asyncio.TimeoutError:
+            pass
+        return await waiter
+
+    assert np.allclose(asyncio.run(run()), provider.vector("x"))
+    assert provider.requests == [["x"]]
+    assert not group._inflight
+
+
+def test_fetch_is_cancelled_when_all_waiters_leave():
+    provider = FakeProvider(delay=0.2)
+    group = make_group(provider)
+
+    async def run():
+        callers = [asyncio.ensure_future(group.get_embedding_async("x")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        # 等待被取消的查询退出
+        await asyncio.sleep(0.01)
+        assert not group._inflight
+        assert all(s.inflight == 0 for s in group.scheduler.stats)
+        # 之后的调用重新发起查询
+        return await group.get_embedding_async("x")
+
+    assert np.allclose(asyncio.run(run()), provider.vector("x"))
+    assert provider.requests == [["x"], ["x"]]
+
+
+class RejectingProvider(FakeProvider):
+    """包含bad的请求返回400"""
+    async def _get_embeddings_async(self, texts):
+        self.requests.append(list(texts))
+        if any("bad" in t for t in texts):
+            raise http_error(400, "invalid input")
+        return [self.vector(t) for t in texts]
+
+
+def test_micro_batch_failure_only_affects_its_own_caller():
+    provider = RejectingProvider()
+    group = make_group(provider, micro_batch=True, micro_batch_window_ms=20)
+
+    texts = [f"good {i}" for i in range(5)] + ["bad"]
+
+    async def run():
+        return await asyncio.gather(*[group.get_embedding_async(t) for t in texts], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(np.allclose(r, provider.vector(f"good {i}")) for i, r in enumerate(results[:5]))
+    assert embedding_providers.status_code_of(results[5]) == 400
+    # 先整批提交一次，失败后逐条查询
+    assert sorted(provider.requests[0]) == sorted(texts)
+    assert sorted(provider.requests[1:]) == sorted([t] for t in texts)
+
+
+def test_closed_stream_releases_pending_chunks():
+    provider = FakeProvider(delay=0.05)
+    group = make_group(provider)
+
+    async def run():
+        stream = group.aembed_stream((f"text {i}" for i in range(100)), chunk_size=8, max_pending=4, ordered=True)
+        async for index, vector in stream:
+            assert vector is not None
+            break
+        await stream.aclose()
+        assert not group._inflight
+        # 同一进程中重新处理相同文本不受之前被取消的块影响
+        return [item async for item in group.aembed_stream([f"text {i}" for i in range(100)], chunk_size=8)]
+
+    results = asyncio.run(run())
+    assert len(results) == 100
+    assert all(np.allclose(v, provider.vector(f"text {i}")) for i, v in results)
+
+
+def test_micro_batch_records_one_cache_lookup_per_call():
+    group = make_group(FakeProvider(), micro_batch=True, micro_batch_window_ms=5)
+    lookups = model_group.CACHE_LOOKUPS
+
+    def count(result):
+        return lookups.get(group=group.name, result=result)
+
+    misses, hits = count("miss"), count("hit")
+    asyncio.run(group.get_embedding_async("only once"))
+    assert count("miss") - misses == 1
+    asyncio.run(group.get_embedding_async("only once"))
+    assert count("hit") - hits == 1
+    assert count("miss") - misses == 1
@@ -0,0 +1,77 @@
+"""
+tests/test_scheduler.py
+调度与熔断：调用方自身的错误输入不应导致服务商被熔断
+"""
+import asyncio
+import random
+
+import pytest
+
+from _common import http_error, load
+
+embedding_providers = load("embedding_providers")
+model_group = load("model_group")
+scheduler = load("scheduler")
+
+
+class FakeProvider(embedding_providers.Provider):
+    """包含bad的请求返回status，fail为True时所有请求返回503"""
+    def __init__(self, name: str, status: int = 400):
+        super().__init__(name, {"embed_model": "fake-model", "batch_size": "8"})
+        self.status = status
+        self.fail = False
+        self.calls = 0
+
+    def _respond(self, texts):
+        if self.fail:
+            raise http_error(503, "service unavailable")
+        if any("bad" in t for t in texts):
+            raise http_error(self.status, "invalid input")
+        return [[random.Random(t).random() for _ in range(4)] for t in texts]
+
+    def _get_embeddings(self, texts):
+        return self._respond(texts)
+
+    async def _get_embeddings_async(self, texts):
+        self.calls += 1
+        return self._respond(texts)
+
+
+def make_group(*providers):
+    config = {"scheduler": {"max_retries": 3, "retry_backoff": 0.0, "breaker_failure_threshold": 1}}
+    return model_group.ModelGroupProvider("group", list(providers), config=config)
+
+
+@pytest.mark.parametrize("status", [400, 413, 422])
+def test_client_error_does_not_open_breakers(status):
+    providers = [FakeProvider("a", status), FakeProvider("b", status)]
+    group = make_group(*providers)
+
+    async def run():
+        for text in ("bad 1", "bad 2", "bad 3"):
+            with pytest.raises(Exception) as info:
+                await group.get_embedding_async(text)
+            assert embedding_providers.status_code_of(info.value) == status
+        return await group.get_embedding_async("good")
+
+    assert asyncio.run(run()) is not None
+    # 每次错误输入只请求一次，不在组内重试
+    assert sum(p.calls for p in providers) == 4
+    assert all(s.breaker.state == scheduler.CircuitBreaker.CLOSED for s in group.scheduler.stats)
+    assert all(s.failures == 0 for s in group.scheduler.stats)
+    # 被动健康检查同样不计入
+    assert all(p.health.healthy and p.health.consecutive_failures == 0 for p in providers)
+
+
+def test_server_error_opens_breaker_and_fails_over():
+    broken, healthy = FakeProvider("a"), FakeProvider("b")
+    group = make_group(broken, healthy)
+    broken.fail = True
+
+    async def run():
+        return [await group.get_embedding_async(f"text {i}") for i in range(3)]
+
+    assert all(v is not None for v in asyncio.run(run()))
+    assert group.scheduler.stats[0].breaker.state == scheduler.CircuitBreaker.OPEN
+    assert group.scheduler.stats[1].breaker.state == scheduler.CircuitBreaker.CLOSED
+    assert broken.health.consecutive_failures > 0
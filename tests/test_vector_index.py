@@ -0,0 +1,42 @@
+"""
+tests/test_vector_index.py
+向量集合的持久化：显式保存与定期自动保存
+"""
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from _common import load
+
+vector_index = load("vector_index")
+
+
+def test_save_collection_writes_dirty_collection(tmp_path):
+    service = vector_index.VectorIndexService(str(tmp_path))
+    collection = service.get_collection("memory", 4)
+    collection.upsert(["a"], np.ones((1, 4), dtype=np.float32))
+    assert not os.path.exists(tmp_path / "memory" / "meta.json")
+
+    service.save_collection("memory")
+    assert os.path.exists(tmp_path / "memory" / "meta.json")
+    assert not collection.dirty
+    with pytest.raises(ValueError):
+        service.save_collection("missing")
+
+
+def test_autosave_persists_dirty_collections(tmp_path):
+    async def main():
+        service = vector_index.VectorIndexService(str(tmp_path))
+        service.start_autosave(0.05)
+        collection = service.get_collection("memory", 4)
+        collection.upsert(["a"], np.ones((1, 4), dtype=np.float32))
+        await asyncio.sleep(0.2)
+        await service.stop_autosave()
+        return collection
+
+    collection = asyncio.run(main())
+    assert not collection.dirty
+    reloaded = vector_index.VectorIndexService(str(tmp_path)).get_collection("memory", 4, create=False)
+    assert reloaded.search(np.ones(4, dtype=np.float32), 1)[0]["id"] == "a"
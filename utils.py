@@ -1,21 +1,37 @@
 from typing import List, Optional, Dict, Any
 import re
+import os
+import json
+import hashlib
 
+import numpy as np
 
 
+
+_CLEAN_PATTERN = re.compile(r'[^a-zA-Z\u4e00-\u9fa5]')
+
 def clean(s: str) -> str:
     # 保留字母，去除数字、标点、空格等
-    return re.sub(r'[^a-zA-Z\u4e00-\u9fa5]', '', s.lower())
+    return _CLEAN_PATTERN.sub('', s.lower())
+
+def char_set(s: str) -> frozenset:
+    """
+    获取字符串清洗后的字符集合，可预先计算后复用
+    """
+    return frozenset(clean(s))
+
+def set_similarity(set_a: frozenset, set_b: frozenset) -> float:
+    """
+    计算两个字符集合的Jaccard相似度
+    """
+    union = len(set_a | set_b)
+    return len(set_a & set_b) / union if union else 0.0
 
 def str_similarity(a: str, b: str) -> float:
     """
     计算两个字符串的Jaccard相似度，不考虑数字、标点和空格等特殊符号
     """
-    a_clean = clean(a)
-    b_clean = clean(b)
-    set_a = set(a_clean)
-    set_b = set(b_clean)
-    return len(set_a & set_b) / len(set_a | set_b) if set_a | set_b else 0.0
+    return set_similarity(char_set(a), char_set(b))
 
 def vec_similarity(a:List[float], b:List[float]) -> float:
     """
@@ -23,7 +39,136 @@ def vec_similarity(a:List[float], b:List[float]) -> float:
     """
     if len(a) != len(b):
         raise ValueError("Vectors must be of the same length")
-    dot_product = sum(x * y for x, y in zip(a, b))
-    norm_a = sum(x ** 2 for x in a) ** 0.5
-    norm_b = sum(y ** 2 for y in b) ** 0.5
-    return dot_product / (norm_a * norm_b) if norm_a and norm_b else 0.0
\ No newline at end of file
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    norm_a = np.linalg.norm(a)
+    norm_b = np.linalg.norm(b)
+    return float(a @ b / (norm_a * norm_b)) if norm_a and norm_b else 0.0
+
+def text_hash(text: str) -> bytes:
+    """
+    计算文本的精确哈希，用作缓存键
+    """
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def vec_fingerprint(vec: List[float]) -> str:
+    """
+    计算向量的指纹，用于区分同名但实际不同的模型
+    """
+    return hashlib.sha1(",".join(f"{x:.4f}" for x in vec).encode("utf-8")).hexdigest()[:16]
+
+
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的token数：中日韩字符按1个token计，其余字符按4个字符1个token计
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+_BOUNDARIES = frozenset(" \t\n。！？；，、.!?;,")
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    按估计token数把文本切成不超过max_tokens的若干段，尽量在空白或标点处断开
+    """
+    if max_tokens <= 0 or estimate_tokens(text) <= max_tokens:
+        return [text]
+    pieces = []
+    start = 0
+    while start < len(text):
+        cjk = other = 0
+        end = start
+        boundary = -1
+        while end < len(text):
+            if _CJK_PATTERN.match(text[end]):
+                cjk += 1
+            else:
+                other += 1
+            if cjk + (other + 3) // 4 > max_tokens:
+                break
+            if text[end] in _BOUNDARIES:
+                boundary = end
+            end += 1
+        # 分隔符位于后半段时在分隔符处断开，否则直接截断
+        if end < len(text) and boundary >= start + (end - start) // 2:
+            end = boundary + 1
+        end = max(end, start + 1)
+        pieces.append(text[start:end])
+        start = end
+    return [p for p in pieces if p.strip()] or [text[:max_tokens]]
+
+def _tail_by_tokens(text: str, tokens: int) -> str:
+    """取文本末尾约tokens个token的部分"""
+    cost = 0.0
+    start = len(text)
+    while start > 0:
+        c = 1.0 if _CJK_PATTERN.match(text[start - 1]) else 0.25
+        if cost + c > tokens:
+            break
+        cost += c
+        start -= 1
+    return text[start:]
+
+def chunk_text(text: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """
+    将长文本切分为不超过max_tokens的块，相邻块之间重叠约overlap_tokens个token
+    """
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    pieces = split_by_tokens(text, max_tokens - overlap_tokens)
+    if overlap_tokens == 0 or len(pieces) == 1:
+        return pieces
+    return [pieces[0]] + [_tail_by_tokens(pieces[i - 1], overlap_tokens) + pieces[i] for i in range(1, len(pieces))]
+
+def pack_by_tokens(costs: List[int], max_count: int, max_tokens: int = 0) -> List[List[int]]:
+    """
+    按token数装箱：先按长度从大到小排序，每个批次从最长的文本开始依次放入，
+    放不下时再用最短的文本填满剩余空间，每批不超过max_count条、max_tokens个token(0表示不限制)
+    单条超过max_tokens的文本单独成批
+    :return: 每个批次包含的下标
+    """
+    order = sorted(range(len(costs)), key=costs.__getitem__, reverse=True)
+    max_count = max(1, max_count)
+    batches = []
+    lo, hi = 0, len(order) - 1
+    while lo <= hi:
+        batch = [order[lo]]
+        total = costs[order[lo]]
+        lo += 1
+        while lo <= hi and len(batch) < max_count and (max_tokens <= 0 or total + costs[order[lo]] <= max_tokens):
+            batch.append(order[lo])
+            total += costs[order[lo]]
+            lo += 1
+        while lo <= hi and len(batch) < max_count and (max_tokens <= 0 or total + costs[order[hi]] <= max_tokens):
+            batch.append(order[hi])
+            total += costs[order[hi]]
+            hi -= 1
+        batches.append(batch)
+    return batches
+
+def write_json_atomic(path: str, data) -> None:
+    """
+    先写入临时文件再替换，避免写入中断导致文件损坏
+    """
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_text_atomic(path: str, text: str) -> None:
+    """
+    先写入临时文件再替换，读取方不会读到写了一半的文件
+    """
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,436 @@
+"""
+vector_index.py
+供其他插件共用的向量集合，支持精确检索与IVF近似检索，使用内存映射文件持久化
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from astrbot.api import logger
+
+from .similarity import as_matrix, normalize, top_k_scores
+from .utils import write_json_atomic
+
+_NAME_PATTERN = re.compile(r"^[\w\-][\w\-.]*$")
+
+BACKENDS = ("auto", "flat", "ivf")
+
+
+# 保存时写入带版本号的数据文件，meta.json中记录对应的文件名
+_DATA_FILE_PATTERN = re.compile(r"^(vectors|labels|centroids)\.\d+\.npy(\.tmp)?$")
+
+
+def _save_npy(path: str, array: np.ndarray):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class IVFIndex:
+    """
+    倒排文件索引：用球面k-means把向量划分到nlist个簇，检索时只计算最近nprobe个簇内的向量
+    簇编号与向量同行存放在VectorCollection中，这里只保存质心
+    """
+    def __init__(self, nprobe: int = 16, iterations: int = 10, sample_per_list: int = 64, seed: int = 0):
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.sample_per_list = sample_per_list
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        # 训练时的向量数，数据量增长到4倍后重新训练
+        self.trained_size = 0
+
+    @staticmethod
+    def list_count(size: int) -> int:
+        return int(min(4096, max(16, math.sqrt(size))))
+
+    def train(self, vectors: np.ndarray):
+        """vectors需已归一化"""
+        size = vectors.shape[0]
+        nlist = min(self.list_count(size), size)
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(size, nlist * self.sample_per_list)
+        sample = vectors[np.sort(rng.choice(size, sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            # 空簇保留原质心
+            empty = counts == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+        self.centroids = centroids
+        self.trained_size = size
+
+    def assign(self, vectors: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        labels = np.empty(vectors.shape[0], dtype=np.int32)
+        for i in range(0, vectors.shape[0], chunk):
+            labels[i:i + chunk] = np.argmax(vectors[i:i + chunk] @ self.centroids.T, axis=1)
+        return labels
+
+    def probe(self, query: np.ndarray) -> np.ndarray:
+        """返回与query最近的nprobe个簇编号"""
+        scores = self.centroids @ query
+        return top_k_scores(scores, self.nprobe)[0]
+
+
+class VectorCollection:
+    """
+    命名向量集合，向量归一化后按行连续存放，删除时用最后一行填补空位
+    backend为auto时数据量达到ivf_threshold后自动启用IVF索引，flat始终精确检索，ivf在数据量较小时也启用索引
+    """
+    def __init__(self, name: str, dim: int, fingerprint: str = "", path: str = "", backend: str = "auto",
+                 nprobe: int = 16, ivf_threshold: int = 20000):
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"集合名称只能包含字母、数字、下划线、短横线和点: {name}")
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的索引类型: {backend}，可选{BACKENDS}")
+        self.name = name
+        self.dim = dim
+        self.fingerprint = fingerprint
+        self.path = path
+        self.backend = backend
+        self.ivf_threshold = ivf_threshold
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Optional[dict]] = []
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._ivf = IVFIndex(nprobe=nprobe)
+        # 已保存的数据文件版本号
+        self._version = 0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._rows
+
+    @property
+    def indexed(self) -> bool:
+        """当前是否使用IVF近似检索"""
+        return self._ivf.centroids is not None and self.backend != "flat"
+
+    def _reserve(self, extra: int):
+        """保证有足够的可写容量，从内存映射文件加载的数组在首次修改时复制到内存"""
+        need = self._size + extra
+        capacity = self._vectors.shape[0]
+        if need <= capacity and not isinstance(self._vectors, np.memmap):
+            return
+        capacity = max(need, capacity * 2 if need > capacity else capacity, 64)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        labels = np.zeros(capacity, dtype=np.int32)
+        labels[:self._size] = self._labels[:self._size]
+        self._vectors, self._labels = vectors, labels
+
+    def _check_vectors(self, ids: Sequence[str], vectors) -> np.ndarray:
+        matrix = as_matrix(vectors)
+        if matrix.shape[0] != len(ids):
+            raise ValueError(f"ids数量({len(ids)})与向量数量({matrix.shape[0]})不一致")
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"向量维数{matrix.shape[1]}与集合{self.name}的维数{self.dim}不一致")
+        return normalize(matrix)
+
+    def upsert(self, ids: Sequence[str], vectors, metadatas: Optional[Sequence[Optional[dict]]] = None):
+        """添加向量，id已存在时覆盖"""
+        ids = list(ids)
+        if len(set(ids)) != len(ids):
+            raise ValueError("ids中存在重复")
+        matrix = self._check_vectors(ids, vectors)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        if len(metadatas) != len(ids):
+            raise ValueError(f"ids数量({len(ids)})与metadatas数量({len(metadatas)})不一致")
+        try:
+            json.dumps(metadatas)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"metadata必须可以序列化为JSON: {str(e)}")
+        with self._lock:
+            self._reserve(len(ids))
+            rows = np.empty(len(ids), dtype=np.int64)
+            for i, id in enumerate(ids):
+                row = self._rows.get(id)
+                if row is None:
+                    row = self._size
+                    self._rows[id] = row
+                    self._ids.append(id)
+                    self._metadata.append(None)
+                    self._size += 1
+                rows[i] = row
+                self._metadata[row] = metadatas[i]
+            self._vectors[rows] = matrix
+            if self._ivf.centroids is not None:
+                self._labels[rows] = self._ivf.assign(matrix)
+            self.dirty = True
+            self._maybe_train()
+
+    def add(self, ids: Sequence[str], vectors, metadatas: Optional[Sequence[Optional[dict]]] = None):
+        """添加向量，id已存在时抛出ValueError"""
+        existing = [id for id in ids if id in self._rows]
+        if existing:
+            raise ValueError(f"集合{self.name}中已存在id: {existing[:5]}")
+        self.upsert(ids, vectors, metadatas)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """删除向量，返回实际删除的数量"""
+        deleted = 0
+        with self._lock:
+            for id in ids:
+                row = self._rows.pop(id, None)
+                if row is None:
+                    continue
+                self._reserve(0)
+                last = self._size - 1
+                if row != last:
+                    # 用最后一行填补被删除的行，保持存储连续
+                    moved = self._ids[last]
+                    self._ids[row] = moved
+                    self._metadata[row] = self._metadata[last]
+                    self._vectors[row] = self._vectors[last]
+                    self._labels[row] = self._labels[last]
+                    self._rows[moved] = row
+                self._ids.pop()
+                self._metadata.pop()
+                self._size -= 1
+                deleted += 1
+            if deleted:
+                self.dirty = True
+        return deleted
+
+    def get(self, id: str) -> Optional[dict]:
+        """按id获取向量(已归一化)与元数据"""
+        row = self._rows.get(id)
+        if row is None:
+            return None
+        return {"id": id, "vector": np.array(self._vectors[row]), "metadata": self._metadata[row]}
+
+    def _maybe_train(self):
+        # 指定ivf时数据量较小也建立索引，但过少时聚类没有意义
+        threshold = self.ivf_threshold if self.backend == "auto" else min(self.ivf_threshold, 1024)
+        if self.backend == "flat" or self._size < threshold:
+            return
+        if self._ivf.centroids is not None and self._size < self._ivf.trained_size * 4:
+            return
+        logger.info(f"向量集合{self.name}构建IVF索引，共{self._size}条向量")
+        vectors = self._vectors[:self._size]
+        self._ivf.train(vectors)
+        self._labels[:self._size] = self._ivf.assign(vectors)
+
+    def rebuild_index(self):
+        """重新训练IVF索引，删除大量数据或数据分布变化后可手动调用"""
+        with self._lock:
+            self._ivf.centroids = None
+            self._ivf.trained_size = 0
+            self._reserve(0)
+            self._maybe_train()
+            self.dirty = True
+
+    def search(self, query, k: int = 5, exact: bool = False) -> List[dict]:
+        """
+        检索与query最相似的k条数据
+        :param exact: 为True时即使已建立IVF索引也进行精确检索
+        :return: [{"id", "score", "metadata"}]，按相似度从高到低排列
+        """
+        q = normalize(query)
+        if q.shape[0] != 1 or q.shape[1] != self.dim:
+            raise ValueError(f"query必须为{self.dim}维的单个向量")
+        q = q[0]
+        with self._lock:
+            vectors = self._vectors[:self._size]
+            rows = None
+            if self.indexed and not exact:
+                rows = np.flatnonzero(np.isin(self._labels[:self._size], self._ivf.probe(q)))
+                # 候选不足k条时退化为精确检索
+                if rows.shape[0] < k:
+                    rows = None
+            if rows is None:
+                indices, scores = top_k_scores(vectors @ q, k)
+            else:
+                indices, scores = top_k_scores(vectors[rows] @ q, k)
+                indices = rows[indices]
+            return [
+                {"id": self._ids[i], "score": float(s), "metadata": self._metadata[i]}
+                for i, s in zip(indices, scores)
+            ]
+
+    def save(self):
+        """
+        保存到path目录，未修改时跳过
+        数据文件按版本号写入新文件，最后原子替换meta.json切换到新版本，保存中断时仍能加载上一版本
+        """
+        if not self.path:
+            raise ValueError(f"集合{self.name}未设置保存路径")
+        with self._lock:
+            if not self.dirty and os.path.exists(os.path.join(self.path, "meta.json")):
+                return
+            os.makedirs(self.path, exist_ok=True)
+            self._version += 1
+            files = {
+                "vectors": f"vectors.{self._version}.npy",
+                "labels": f"labels.{self._version}.npy",
+            }
+            _save_npy(os.path.join(self.path, files["vectors"]), np.ascontiguousarray(self._vectors[:self._size]))
+            _save_npy(os.path.join(self.path, files["labels"]), np.ascontiguousarray(self._labels[:self._size]))
+            if self._ivf.centroids is not None:
+                files["centroids"] = f"centroids.{self._version}.npy"
+                _save_npy(os.path.join(self.path, files["centroids"]), np.asarray(self._ivf.centroids))
+            write_json_atomic(os.path.join(self.path, "meta.json"), {
+                "name": self.name,
+                "dim": self.dim,
+                "fingerprint": self.fingerprint,
+                "backend": self.backend,
+                "nprobe": self._ivf.nprobe,
+                "ivf_threshold": self.ivf_threshold,
+                "trained_size": self._ivf.trained_size,
+                "size": self._size,
+                "ids": self._ids,
+                "metadata": self._metadata,
+                "version": self._version,
+                "files": files,
+            })
+            self.dirty = False
+            self._remove_stale_files(set(files.values()))
+
+    def _remove_stale_files(self, keep: set):
+        """删除旧版本与中断保存留下的数据文件"""
+        for file_name in os.listdir(self.path):
+            legacy = file_name in ("vectors.npy", "labels.npy", "centroids.npy")
+            if file_name in keep or not (legacy or _DATA_FILE_PATTERN.match(file_name)):
+                continue
+            try:
+                os.remove(os.path.join(self.path, file_name))
+            except OSError as e:
+                # Windows下仍被内存映射的文件无法删除，下次保存时再清理
+                logger.debug(f"删除向量集合旧文件{file_name}失败: {str(e)}")
+
+    @classmethod
+    def load(cls, path: str) -> "VectorCollection":
+        """从path目录加载，向量以只读内存映射方式打开，修改时才复制到内存"""
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        collection = cls(meta["name"], meta["dim"], meta.get("fingerprint", ""), path,
+                         backend=meta.get("backend", "auto"), nprobe=meta.get("nprobe", 16),
+                         ivf_threshold=meta.get("ivf_threshold", 20000))
+        size = meta["size"]
+        # 旧版本保存的集合没有files字段，使用固定文件名
+        files = meta.get("files") or {"vectors": "vectors.npy", "labels": "labels.npy", "centroids": "centroids.npy"}
+        collection._version = meta.get("version", 0)
+        vectors = np.load(os.path.join(path, files["vectors"]), mmap_mode="r")
+        labels = np.load(os.path.join(path, files["labels"]), mmap_mode="r")
+        if vectors.shape != (size, meta["dim"]) or labels.shape[0] != size or len(meta["ids"]) != size:
+            raise ValueError(f"向量集合{meta['name']}文件不完整")
+        collection._vectors, collection._labels = vectors, labels
+        collection._ids = meta["ids"]
+        collection._metadata = meta["metadata"]
+        collection._rows = {id: i for i, id in enumerate(collection._ids)}
+        collection._size = size
+        centroids_path = os.path.join(path, files.get("centroids", ""))
+        if files.get("centroids") and os.path.exists(centroids_path):
+            collection._ivf.centroids = np.load(centroids_path, mmap_mode="r")
+            collection._ivf.trained_size = meta.get("trained_size", size)
+        return collection
+
+
+class VectorIndexService:
+    """管理保存在base_dir下的所有命名集合"""
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._collections: Dict[str, VectorCollection] = {}
+        self._lock = threading.Lock()
+        self._autosave_task: Optional[asyncio.Task] = None
+
+    def _path(self, name: str) -> str:
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"集合名称只能包含字母、数字、下划线、短横线和点: {name}")
+        return os.path.join(self.base_dir, name)
+
+    def get_collection(self, name: str, dim: int, fingerprint: str = "", backend: str = "auto",
+                       create: bool = True, **kwargs) -> VectorCollection:
+        """
+        获取集合，不存在时创建
+        集合与创建时的模型绑定，fingerprint或维数不一致时抛出ValueError
+        """
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None and os.path.exists(os.path.join(self._path(name), "meta.json")):
+                collection = VectorCollection.load(self._path(name))
+                self._collections[name] = collection
+            if collection is None:
+                if not create:
+                    raise ValueError(f"向量集合{name}不存在")
+                collection = VectorCollection(name, dim, fingerprint, self._path(name), backend=backend, **kwargs)
+                self._collections[name] = collection
+                return collection
+        if collection.dim != dim or (fingerprint and collection.fingerprint and collection.fingerprint != fingerprint):
+            raise ValueError(f"向量集合{name}属于其他模型(维数{collection.dim})，请切换模型组或使用其他集合名称")
+        return collection
+
+    def list_collections(self) -> List[str]:
+        names = set(self._collections)
+        if os.path.isdir(self.base_dir):
+            names.update(n for n in os.listdir(self.base_dir)
+                         if os.path.exists(os.path.join(self.base_dir, n, "meta.json")))
+        return sorted(names)
+
+    def drop_collection(self, name: str) -> bool:
+        with self._lock:
+            existed = self._collections.pop(name, None) is not None
+            if os.path.isdir(self._path(name)):
+                shutil.rmtree(self._path(name))
+                existed = True
+            return existed
+
+    def save_collection(self, name: str):
+        """立即保存集合，未修改时不写文件，集合不存在时抛出ValueError"""
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None and not os.path.exists(os.path.join(self._path(name), "meta.json")):
+                raise ValueError(f"向量集合{name}不存在")
+        if collection is not None:
+            collection.save()
+
+    def save_all(self):
+        for collection in list(self._collections.values()):
+            try:
+                collection.save()
+            except Exception as e:
+                logger.error(f"保存向量集合{collection.name}失败: {str(e)}")
+
+    def start_autosave(self, interval: float):
+        """在运行中的事件循环上每interval秒保存一次有修改的集合，interval<=0或没有事件循环时不启动"""
+        if interval <= 0 or (self._autosave_task is not None and not self._autosave_task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._autosave_task = loop.create_task(self._autosave(interval))
+
+    async def stop_autosave(self):
+        if self._autosave_task is None:
+            return
+        self._autosave_task.cancel()
+        try:
+            await self._autosave_task
+        except asyncio.CancelledError:
+            pass
+        self._autosave_task = None
+
+    async def _autosave(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            # 写文件较慢，放到线程中执行，save_all已记录各集合的错误
+            await asyncio.to_thread(self.save_all)